@@ -3,19 +3,43 @@ from datetime import date
 import typer
 
 
-def validate_date(date_str: str) -> None:
+def validate_date(date_str: str) -> date:
     """
     Validates that a date string is in the correct YYYY-MM-DD format.
     
     Args:
-        date_str: The date string to validate (can be any type, will be converted to string)
+        date_str: The date to validate, as a YYYY-MM-DD string. Other types are rejected
+        
+    Returns:
+        date: The parsed date, so callers don't need to parse the string again
         
     Raises:
         typer.BadParameter: If the date format is invalid
+        TypeError: If the date is not a string
     """
+    if not isinstance(date_str, str):
+        raise TypeError(f"Date must be a string, not {type(date_str).__name__}")
+    
+    # Reject anything not shaped like YYYY-MM-DD before parsing, fromisoformat also
+    # accepts other ISO 8601 forms (e.g. '20250629') on recent Python versions
+    if not (
+        len(date_str) == 10
+        and date_str[4] == '-'
+        and date_str[7] == '-'
+        and date_str[:4].isdigit()
+        and date_str[5:7].isdigit()
+        and date_str[8:].isdigit()
+    ):
+        raise _invalid_date_error(date_str)
+    
     try:
-        date.fromisoformat(date_str)
+        return date.fromisoformat(date_str)
     except ValueError:
-        raise typer.BadParameter(
-            f"Invalid date format: {date_str}. Please use YYYY-MM-DD format."
-        )
\ No newline at end of file
+        raise _invalid_date_error(date_str)
+
+
+def _invalid_date_error(date_str: str) -> typer.BadParameter:
+    """Builds the error raised for a date that is not in YYYY-MM-DD format."""
+    return typer.BadParameter(
+        f"Invalid date format: {date_str}. Please use YYYY-MM-DD format."
+    )
\ No newline at end of file
@@ -1,30 +1,86 @@
+import datetime
+import functools
 import os
+import threading
+from typing import TYPE_CHECKING
 
 import google.auth
+import google.auth.credentials
 import google.auth.transport.requests
 import google.oauth2.credentials
-from google.cloud import bigquery, storage  # type: ignore
+from google.cloud import storage  # type: ignore
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    # BigQuery is imported in ConnectBQ only, so the GCS-only entrypoints don't pay for it
+    from google.cloud import bigquery  # type: ignore
+
+# Refresh the default credentials this long before they expire, so a token handed
+# out to a long run is not invalidated part way through
+_TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Covers the storage and BigQuery APIs alike
+_CLOUD_PLATFORM_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+# Default credentials are loaded once and shared between threads
+_default_credentials_lock = threading.Lock()
+_default_credentials = None
+
+
+def _credentials_need_refresh(creds) -> bool:
+    """
+    Checks whether credentials have no token yet or expire within the refresh margin.
+
+    Args:
+        creds: The Google credentials to check.
+
+    Returns:
+        bool: True if the credentials must be refreshed before use.
+    """
+    if not creds.token or not isinstance(creds.expiry, datetime.datetime):
+        return True
+
+    # google-auth stores expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - _TOKEN_REFRESH_MARGIN <= now
 
 
 def get_gcp_token_from_default_credentials() -> str:
     """
     Obtain an access token from Google Cloud Platform default credentials.
 
-    This function retrieves default application credentials, refreshes them
-    to ensure they are valid, and returns the access token. The token can be
-    used to authenticate requests to Google Cloud Platform services.
+    This function retrieves default application credentials once, refreshes them
+    when they are about to expire, and returns the access token. The token can be
+    used to authenticate requests to Google Cloud Platform services. It is safe to
+    call from several threads.
 
     Returns:
         str: The access token obtained from the default credentials.
     """
+    global _default_credentials
+
+    with _default_credentials_lock:
+        if _default_credentials is None:
+            _default_credentials, _ = google.auth.default(scopes=_CLOUD_PLATFORM_SCOPES)
+
+        if _credentials_need_refresh(_default_credentials):
+            auth_req = google.auth.transport.requests.Request()
+            _default_credentials.refresh(auth_req)
 
-    creds, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+        return _default_credentials.token
 
-    auth_req = google.auth.transport.requests.Request()
-    creds.refresh(auth_req)
 
-    return creds.token
+def _reset_default_credentials() -> None:
+    """Drops the cached credentials and clients, so the next call loads them again."""
+    global _default_credentials
+
+    with _default_credentials_lock:
+        _default_credentials = None
+    _credentials_from_token.cache_clear()
+    _storage_client.cache_clear()
+    _bigquery_client.cache_clear()
 
 
 def get_token_from_env_var(env_var_token: str | None) -> str | None:
@@ -33,6 +89,92 @@ def get_token_from_env_var(env_var_token: str | None) -> str | None:
     else:
         return None
 
+@functools.lru_cache(maxsize=8)
+def _credentials_from_token(token: str) -> google.oauth2.credentials.Credentials:
+    """
+    Builds credentials from an access token, shared by every client using the same token.
+
+    Args:
+        token (str): The GCP access token.
+
+    Returns:
+        google.oauth2.credentials.Credentials: The credentials wrapping the token.
+    """
+    return google.oauth2.credentials.Credentials(token)
+
+
+def _pooled_session(creds) -> google.auth.transport.requests.AuthorizedSession:
+    """
+    Builds an authorized HTTP session with a larger keep-alive connection pool for a Google Cloud client.
+
+    The default pool of `requests` only keeps 10 connections, fewer than the concurrent
+    uploads and load job calls, so extra connections were opened and closed each time.
+    Transient connection errors are retried with a backoff.
+
+    Args:
+        creds: The Google credentials authorizing the requests of the session.
+
+    Returns:
+        google.auth.transport.requests.AuthorizedSession: The session to hand to the client.
+    """
+    session = google.auth.transport.requests.AuthorizedSession(creds)
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.2)
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+@functools.lru_cache(maxsize=8)
+def _storage_client(token: str | None) -> storage.Client:
+    """
+    Builds the storage client of a token once, so every ConnectGCS shares its connection pool.
+
+    Args:
+        token (str | None): The GCP access token, or None to use default credentials.
+
+    Returns:
+        storage.Client: The storage client with a pooled HTTP session.
+    """
+    creds: google.auth.credentials.Credentials
+    if token:
+        logger.info("Using token to connect to GCS")
+        creds = _credentials_from_token(token)
+    else:
+        logger.info("Using default creds to connect to GCS")
+        # The client needs the credentials up front to be handed its own session
+        creds, _ = google.auth.default(scopes=_CLOUD_PLATFORM_SCOPES)
+    
+    return storage.Client(credentials=creds, _http=_pooled_session(creds))
+
+
+@functools.lru_cache(maxsize=8)
+def _bigquery_client(token: str | None) -> "bigquery.Client":
+    """
+    Builds the BigQuery client of a token once, so every ConnectBQ shares its connection pool.
+
+    Args:
+        token (str | None): The GCP access token, or None to use default credentials.
+
+    Returns:
+        bigquery.Client: The BigQuery client with a pooled HTTP session.
+    """
+    creds: google.auth.credentials.Credentials
+    if token:
+        logger.info("Using token to connect to BQ")
+        creds = _credentials_from_token(token)
+    else:
+        logger.info("Using default creds to connect to BQ")
+        # The client needs the credentials up front to be handed its own session
+        creds, _ = google.auth.default(scopes=_CLOUD_PLATFORM_SCOPES)
+    
+    from google.cloud import bigquery  # type: ignore
+
+    return bigquery.Client(credentials=creds, _http=_pooled_session(creds))
+
+
 class ConnectGCS:
     def __init__(
         self,
@@ -45,29 +187,29 @@ class ConnectGCS:
             token (str | None): Optional, a GCP token to use for authentication.
                 If not provided, default credentials will be used.
         """
-        self._connnect_to_gcs(token)
+        # The client is only built on first use, so a run failing before it needs
+        # GCS does not pay for auth discovery
+        self._token = token or None
+        self._client: storage.Client | None = None
     
     @property
     def client(self) -> storage.Client:
+        if self._client is None:
+            self._client = self._connnect_to_gcs(self._token)
         return self._client
         
     def _connnect_to_gcs(
         self,
         token: str | None = None
-    ) -> None:
+    ) -> storage.Client:
         """
-        Connect to GCS using the provided token, or default credentials if no token is provided
+        Connect to GCS using the provided token, or default credentials if no token is provided.
+        The client is shared with every other ConnectGCS using the same token.
         """
-        if token:
-            logger.info("Using token to connect to GCS")
-            creds = google.oauth2.credentials.Credentials(token)
-        else:
-            logger.info("Using default creds to connect to GCS")
-            creds = None
-        
-        self._client =  storage.Client(credentials=creds)
+        client = _storage_client(token or None)
         
         logger.info("Connected to GCS")
+        return client
         
         
 class ConnectBQ:
@@ -82,26 +224,26 @@ class ConnectBQ:
             token (str | None): Optional, a GCP token to use for authentication.
                 If not provided, default credentials will be used.
         """
-        self._connnect_to_bq(token)
+        # The client is only built on first use, so a run failing before it needs
+        # BQ does not pay for auth discovery
+        self._token = token or None
+        self._client: "bigquery.Client" | None = None
     
     @property
-    def client(self) -> bigquery.Client:
+    def client(self) -> "bigquery.Client":
+        if self._client is None:
+            self._client = self._connnect_to_bq(self._token)
         return self._client
         
     def _connnect_to_bq(
         self,
         token: str | None = None
-    ) -> None:
+    ) -> "bigquery.Client":
         """
-        Connect to BQ using the provided token, or default credentials if no token is provided
+        Connect to BQ using the provided token, or default credentials if no token is provided.
+        The client is shared with every other ConnectBQ using the same token.
         """
-        if token:
-            logger.info("Using token to connect to BQ")
-            creds = google.oauth2.credentials.Credentials(token)
-        else:
-            logger.info("Using default creds to connect to BQ")
-            creds = None
-        
-        self._client =  bigquery.Client(credentials=creds)
+        client = _bigquery_client(token or None)
         
-        logger.info("Connected to BQ")
\ No newline at end of file
+        logger.info("Connected to BQ")
+        return client
\ No newline at end of file
@@ -1,6 +1,9 @@
+import asyncio
 import datetime
+import functools
+import io
 import os
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import polars as pl
 import requests
@@ -8,10 +11,68 @@ import typer
 from dotenv import load_dotenv
 from google.cloud import storage  # type: ignore
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from at_bus_load import entrypoints_params
 from at_bus_load.gcp import ConnectGCS, get_token_from_env_var
 
+# Level 1 ZSTD encodes as fast as LZ4 but the files are about a third smaller, so
+# fewer bytes are uploaded. No column statistics keep encoding cheap
+_PARQUET_OPTS: Dict[str, Any] = {
+    "compression": "zstd",
+    "compression_level": 1,
+    "statistics": False,
+}
+
+# Stop codes kept by filter_stops_data, built once rather than on every call
+_STOP_CODES = pl.Series(
+    "stop_codes",
+    [
+        "8147",
+        "8545",
+        "7149",
+        "8331",
+        "7133"
+    ],
+    dtype=pl.Utf8
+)
+# The filter expression is built once too, so each call only runs the hash lookup
+_STOP_CODES_FILTER = pl.col("stop_code").is_in(_STOP_CODES.implode())
+
+
+def _build_session() -> requests.Session:
+    """
+    Builds the HTTP session shared by every AT API call.
+
+    The session keeps a pool of keep-alive connections, large enough for the concurrent
+    trips fetches, so the TCP + TLS handshake is reused across requests. Transient
+    connection errors, throttling and server errors are retried with a backoff; once
+    the retries are exhausted the last response is returned to the caller.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+# Shared by every AT API call
+_SESSION = _build_session()
+
+# Connect and read timeouts of the AT API calls, in seconds
+_REQUEST_TIMEOUT = (5, 30)
+
 
 def get_at_gtfs_data_from_at_mobile_api(
     data_name: str,
@@ -32,38 +93,51 @@ def get_at_gtfs_data_from_at_mobile_api(
     """
     url = f"https://api.at.govt.nz/gtfs/v3/{data_name}"
     
-    response = requests.get(
+    response = _SESSION.get(
         url,
         params=params, 
-        headers=headers
+        headers=headers,
+        stream=True,
+        timeout=_REQUEST_TIMEOUT
     )
     
-    # logger.info(f"Request URL: {response.url}")
-    if response.status_code != 200:
-        logger.error(f"Request failed with status code {response.status_code}: {response.text}")
-        raise Exception(f"Request failed with status code {response.status_code}: {response.text}")
-    else:
-        data = response.json()
-        if "data" not in data:
-            logger.error("Expected 'data' key in the JSON response")
-        
-        logger.info(f"Successfully getting data from request '{response.url}'.")
-        
-        json_data = data["data"]
-
-        # Load data into Polars DataFrame
-        df = pl.DataFrame(json_data)
-        
-        for col, dtype in df.schema.items():
-            if isinstance(dtype, pl.datatypes.Struct):
-                df = df.unnest(col)
-                
-        return df
+    try:
+        # logger.info(f"Request URL: {response.url}")
+        if response.status_code != 200:
+            logger.error(f"Request failed with status code {response.status_code}: {response.text}")
+            raise Exception(f"Request failed with status code {response.status_code}: {response.text}")
+        # Read the body in a single call rather than letting requests join
+        # 10 KiB chunks, so only one copy of the payload is held in memory
+        body = response.raw.read(decode_content=True)
+    finally:
+        response.close()
+    
+    # Parse the body straight into Arrow arrays, without building a Python
+    # object for every record and field
+    data = pl.read_json(io.BytesIO(body))
+    del body
+    if "data" not in data.columns:
+        logger.error("Expected 'data' key in the JSON response")
+        raise KeyError("data")
+    
+    logger.debug("Successfully getting data from request '{}'.", response.url)
+    
+    # One row per record; an empty 'data' list explodes to a single null row
+    records = data.select("data").explode("data")
+    if not isinstance(records.schema["data"], pl.Struct):
+        return pl.DataFrame()
+    
+    # The keys of nested objects (e.g. the JSON:API `attributes`) become top-level columns
+    df = records.unnest("data")
+    return df.unnest([name for name, dtype in df.schema.items() if isinstance(dtype, pl.Struct)])
     
+@functools.lru_cache(maxsize=1)
 def get_at_api_key() -> str:
     """
     Retrieves the Auckland Transport API key from environment variables.
 
+    The key is cached after the first successful lookup.
+
     Returns:
         str: The API key for accessing Auckland Transport services.
 
@@ -85,12 +159,106 @@ def get_at_api_key() -> str:
     
     return api_key
 
-def get_stops_data(api_date: str) -> pl.DataFrame:
+def get_at_api_headers() -> Dict[str, str]:
+    """
+    Builds the headers sent with every request to the Auckland Transport GTFS API.
+
+    Returns:
+        Dict[str, str]: The request headers, including the API subscription key.
+    """
+    return {
+        "Cache-Control": "no-cache",
+        "Ocp-Apim-Subscription-Key": get_at_api_key()
+    }
+
+def _api_date_ingestion_column(api_date: str | datetime.date) -> pl.Expr:
+    """
+    Builds the 'api_date_ingestion' literal column added to the fetched data.
+
+    Args:
+        api_date (str | datetime.date): The date of the data. Passing a date avoids parsing the string again.
+
+    Returns:
+        pl.Expr: A `pl.Date` literal named 'api_date_ingestion'.
+    """
+    if isinstance(api_date, str):
+        api_date = datetime.date.fromisoformat(api_date)
+    return pl.lit(api_date, dtype=pl.Date).alias("api_date_ingestion")
+
+# Every day is loaded into a partition of the same stops table, whose schema is set by
+# the first load. The dtypes inferred from a response depend on its values (an all-null
+# column, a float among integers), so the files are written with this schema instead
+_STOPS_SCHEMA = pl.Schema({
+    "type": pl.Utf8,
+    "id": pl.Utf8,
+    "location_type": pl.Int64,
+    "parent_station": pl.Utf8,
+    "platform_code": pl.Utf8,
+    "stop_code": pl.Utf8,
+    "stop_id": pl.Utf8,
+    "stop_lat": pl.Float64,
+    "stop_lon": pl.Float64,
+    "stop_name": pl.Utf8,
+    "wheelchair_boarding": pl.Int64,
+})
+
+# Every stop's trips file of a date is loaded by one wildcard job, so on top of the
+# table schema the files of all the stops must match each other
+_TRIPS_SCHEMA = pl.Schema({
+    "type": pl.Utf8,
+    "id": pl.Utf8,
+    "arrival_time": pl.Utf8,
+    "departure_time": pl.Utf8,
+    "direction_id": pl.Int64,
+    "drop_off_type": pl.Int64,
+    "pickup_type": pl.Int64,
+    "route_id": pl.Utf8,
+    "service_date": pl.Utf8,
+    "shape_id": pl.Utf8,
+    "stop_headsign": pl.Utf8,
+    "stop_id": pl.Utf8,
+    "stop_sequence": pl.Int64,
+    "trip_headsign": pl.Utf8,
+    "trip_id": pl.Utf8,
+    "trip_start_time": pl.Utf8,
+})
+
+def _conform_to_schema(df: pl.DataFrame, schema: pl.Schema, data_name: str) -> pl.DataFrame:
+    """
+    Casts the data fetched from the AT API to a pinned schema.
+
+    Fields missing from the response are added as nulls. Fields the schema doesn't know
+    are dropped with a warning, so a new API field is added to the schema deliberately
+    rather than changing the tables on its own.
+
+    Args:
+        df (pl.DataFrame): The data returned by `get_at_gtfs_data_from_at_mobile_api`.
+        schema (pl.Schema): The column names and dtypes of the files written for this data.
+        data_name (str): The name of the data, used in the log messages.
+
+    Returns:
+        pl.DataFrame: The data with exactly the columns and dtypes of `schema`, in its order.
+    """
+    if df.is_empty():
+        return pl.DataFrame(schema=schema)
+    
+    unknown_columns = [name for name in df.columns if name not in schema]
+    if unknown_columns:
+        logger.warning("Dropping {} fields missing from the schema: {}", data_name, unknown_columns)
+    
+    return df.with_columns(
+        pl.lit(None, dtype=dtype).alias(name)
+        for name, dtype in schema.items()
+        if name not in df.columns
+    ).select(pl.col(name).cast(dtype) for name, dtype in schema.items())
+
+def get_stops_data(api_date: str | datetime.date, headers: Optional[Dict[str, str]] = None) -> pl.DataFrame:
     """
     Fetches the stops data for a given date from the Auckland Transport GTFS API.
 
     Args:
-        api_date (str): The date for which to fetch the stops data in 'YYYY-MM-DD' format.
+        api_date (str | datetime.date): The date for which to fetch the stops data, as a date or in 'YYYY-MM-DD' format.
+        headers (Optional[Dict[str, str]]): The request headers. Built with `get_at_api_headers` if not provided.
 
     Returns:
         pl.DataFrame: A Polars DataFrame containing the stops data with an additional column 'api_date_ingestion'
@@ -104,14 +272,12 @@ def get_stops_data(api_date: str) -> pl.DataFrame:
         df_stops = get_at_gtfs_data_from_at_mobile_api(
             data_name="stops",
             params={
-                "filter[date]": api_date
+                "filter[date]": str(api_date)
             },
-            headers = {
-                "Cache-Control": "no-cache",
-                "Ocp-Apim-Subscription-Key": get_at_api_key()
-            }
-        ).with_columns(
-            pl.lit(api_date).cast(pl.Date).alias("api_date_ingestion"),
+            headers=headers if headers is not None else get_at_api_headers()
+        )
+        df_stops = _conform_to_schema(df_stops, _STOPS_SCHEMA, "stops").with_columns(
+            _api_date_ingestion_column(api_date)
         )
             
         return df_stops
@@ -137,31 +303,36 @@ def filter_stops_data(stops_data: pl.DataFrame) -> pl.DataFrame:
         Logs an error if there is an error while filtering the data.
     """
     try:
-        stop_codes = [
-            "8147",
-            "8545",
-            "7149",
-            "8331",
-            "7133"
-        ]
-        
-        _df = (
-            stops_data
-            .filter(
-                pl.col("stop_code")
-                .is_in(stop_codes)
-            )
-        )
+        _df = stops_data.filter(_STOP_CODES_FILTER)
         logger.info("Successfully filtered stop data.")
         return _df
     except Exception as e:
         logger.error(f"Error filtering stop data: {e}")
         raise
 
+def upload_parquet_to_gcs(df: pl.DataFrame, blob: storage.Blob) -> None:
+    """
+    Serialises a Polars DataFrame to Parquet in memory and uploads it to a GCS blob.
+
+    Args:
+        df: The Polars DataFrame to upload.
+        blob: The GCS blob to upload the Parquet file to.
+
+    Returns:
+        None
+    """
+    buffer = io.BytesIO()
+    # A single row group avoids per-group metadata on these small frames
+    df.write_parquet(buffer, row_group_size=df.height or None, **_PARQUET_OPTS)
+    size = buffer.tell()
+    buffer.seek(0)
+    
+    blob.upload_from_file(buffer, content_type="application/octet-stream", size=size)
+
 def send_stop_data_to_gcs(
     client: storage.Client,
     df_stops: pl.DataFrame,
-    api_date: str
+    api_date: str | datetime.date
 ) -> None:
     """
     Sends the stops data to Google Cloud Storage.
@@ -189,22 +360,25 @@ def send_stop_data_to_gcs(
         bucket = client.bucket("at-bus-open-data")
         blob = bucket.blob(f"{api_date}/stops.parquet")
         
-        df_stops.write_parquet("data/stops.parquet")
-        
-        blob.upload_from_filename("data/stops.parquet")
+        upload_parquet_to_gcs(df_stops, blob)
         
         logger.info("Successfully uploaded stop data to GCS.")
     except Exception as e:
         logger.error(f"Error uploading stop data to GCS: {e}")
         raise
 
-def get_trips_data(stop_id: str, api_date: str) -> pl.DataFrame:
+def get_trips_data(
+    stop_id: str,
+    api_date: str | datetime.date,
+    headers: Optional[Dict[str, str]] = None
+) -> pl.DataFrame:
     """
     Fetches the trips data for a given stop and date from the AT API, and returns it as a Polars DataFrame.
 
     Args:
         stop_id (str): The ID of the stop for which to fetch trips data.
-        api_date (str): The date for which to fetch trips data.
+        api_date (str | datetime.date): The date for which to fetch trips data.
+        headers (Optional[Dict[str, str]]): The request headers. Built with `get_at_api_headers` if not provided.
 
     Returns:
         pl.DataFrame: A Polars DataFrame containing the trips data for the specified stop and date.
@@ -220,19 +394,23 @@ def get_trips_data(stop_id: str, api_date: str) -> pl.DataFrame:
         df_trips = get_at_gtfs_data_from_at_mobile_api(
             data_name=f"stops/{stop_id}/stoptrips",
             params={
-                "filter[date]": api_date,
+                "filter[date]": str(api_date),
                 "filter[start_hour]": 3,
                 "filter[hour_range]": 24
             },
-            headers = {
-                "Cache-Control": "no-cache",
-                "Ocp-Apim-Subscription-Key": get_at_api_key()
-            }
-        ).with_columns(
-            pl.lit(api_date).cast(pl.Date).alias("api_date_ingestion"),
+            headers=headers if headers is not None else get_at_api_headers()
         )
         
-        logger.info(f"Successfully loaded trip data for stop {stop_id} on date {api_date}.")
+        if df_trips.is_empty():
+            # Adding the ingestion date would turn the empty frame into a single row
+            logger.info("No trip data for stop {} on date {}.", stop_id, api_date)
+            return df_trips
+        
+        df_trips = _conform_to_schema(df_trips, _TRIPS_SCHEMA, "trips").with_columns(
+            _api_date_ingestion_column(api_date)
+        )
+        
+        logger.info("Successfully loaded trip data for stop {} on date {}.", stop_id, api_date)
         return df_trips
     except Exception as e:
         logger.error(f"Error loading trips data for stop {stop_id} on date {api_date}: {e}")
@@ -242,7 +420,7 @@ def send_trips_data_to_gcs(
     client: storage.Client,
     df_trips: pl.DataFrame,
     stop_id: str,
-    api_date: str
+    api_date: str | datetime.date
 ) -> None:
     """
     Sends the trips data to Google Cloud Storage.
@@ -271,16 +449,95 @@ def send_trips_data_to_gcs(
         bucket = client.bucket("at-bus-open-data")
         blob = bucket.blob(f"{api_date}/trips_{stop_id}.parquet")
         
-        df_trips.write_parquet(f"data/trips_{stop_id}.parquet")
+        upload_parquet_to_gcs(df_trips, blob)
         
-        blob.upload_from_filename(f"data/trips_{stop_id}.parquet")
-        
-        logger.info(f"Successfully uploaded trip data for stop {stop_id} to GCS.")
+        logger.info("Successfully uploaded trip data for stop {} to GCS.", stop_id)
     except Exception as e:
         logger.error(f"Error uploading trip data for stop {stop_id} to GCS: {e}")
         raise
 
 
+async def get_and_send_all_trips_data(
+    client: storage.Client,
+    stop_ids: List[str],
+    api_date: str | datetime.date,
+    headers: Optional[Dict[str, str]] = None,
+    max_concurrency: int = 16,
+    max_uploads: int = 4
+) -> None:
+    """
+    Fetches the trips data for several stops concurrently and uploads each one to GCS.
+
+    The upload of a stop starts in a worker thread as soon as its trips data is fetched,
+    so it overlaps with the fetches of the other stops instead of waiting for all of them.
+    Stops without trips data are not uploaded.
+
+    Args:
+        client (storage.Client): The Google Cloud Storage client, shared by every upload.
+        stop_ids (List[str]): The IDs of the stops for which to fetch and upload trips data.
+        api_date (str | datetime.date): The date for which to fetch trips data.
+        headers (Optional[Dict[str, str]]): The request headers. Built with `get_at_api_headers` if not provided.
+        max_concurrency (int): The maximum number of requests in flight at the same time.
+        max_uploads (int): The maximum number of uploads in flight at the same time.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: If the trips data of any stop can't be fetched or uploaded, the first exception is re-raised.
+    """
+    if headers is None:
+        headers = get_at_api_headers()
+    fetch_semaphore = asyncio.Semaphore(max_concurrency)
+    upload_semaphore = asyncio.Semaphore(max_uploads)
+
+    async def _get_and_send_trips_data(stop_id: str) -> None:
+        async with fetch_semaphore:
+            df_trips = await asyncio.to_thread(get_trips_data, stop_id, api_date, headers)
+
+        if df_trips.is_empty():
+            logger.info("Skipping upload of empty trip data for stop {}.", stop_id)
+            return
+
+        async with upload_semaphore:
+            await asyncio.to_thread(send_trips_data_to_gcs, client, df_trips, stop_id, api_date)
+
+    await asyncio.gather(*(_get_and_send_trips_data(stop_id) for stop_id in stop_ids))
+
+
+async def send_all_data_to_gcs(
+    client: storage.Client,
+    df_stops: pl.DataFrame,
+    api_date: str | datetime.date,
+    headers: Optional[Dict[str, str]] = None
+) -> None:
+    """
+    Uploads the stops data to GCS while the trips data of every stop is fetched and uploaded.
+
+    The stops upload runs in a worker thread, so it no longer delays the first trips request.
+    Every upload shares the same client and its pooled HTTP sessions.
+
+    Args:
+        client (storage.Client): The Google Cloud Storage client, shared by every upload.
+        df_stops (pl.DataFrame): The filtered stops data, whose IDs are used to fetch the trips data.
+        api_date (str | datetime.date): The date of the data.
+        headers (Optional[Dict[str, str]]): The request headers. Built with `get_at_api_headers` if not provided.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: If any upload or fetch fails, the first exception is re-raised.
+    """
+    stop_ids = df_stops["id"].to_list()
+    logger.info("Fetching trips for stops {} on date {}", stop_ids, api_date)
+
+    await asyncio.gather(
+        asyncio.to_thread(send_stop_data_to_gcs, client, df_stops, api_date),
+        get_and_send_all_trips_data(client, stop_ids, api_date, headers)
+    )
+
+
 def main(
     date: str = typer.Option(
         default=datetime.date.today().strftime("%Y-%m-%d"),
@@ -297,33 +554,33 @@ def main(
     This function parses command line arguments, loads environment variables,
     and establishes a connection to Google Cloud Storage using a token. It
     retrieves bus stop data for a specified date, filters the data, and uploads
-    it to GCS. For each bus stop, it fetches trip data and uploads it to GCS.
+    it to GCS. The trip data of every bus stop is fetched concurrently with that
+    upload, each stop being uploaded to GCS as soon as its data is fetched.
 
     Raises:
         Exception: If there are any errors uploading data to GCS.
     """
     
-    entrypoints_params.validate_date(date)
-    api_date = date
+    # Parsed once, then shared by every fetch and upload
+    api_date = entrypoints_params.validate_date(date)
     
     logger.info(f"Fetching data for date: {api_date}")
     
     load_dotenv()
+    headers = get_at_api_headers()
     
     token = get_token_from_env_var(env_var_token)
-    client = ConnectGCS(token).client
+    gcs = ConnectGCS(token)
     
-    df_stops = get_stops_data(api_date)
+    df_stops = get_stops_data(api_date, headers)
     df_stops = filter_stops_data(df_stops)
     
-    send_stop_data_to_gcs(client, df_stops, api_date)
+    # The GCS client is only built once there is data to upload
+    if df_stops.is_empty():
+        logger.warning("No stops data to upload for date: {}", api_date)
+        return
     
-    stop_ids = df_stops["id"].to_list()
-    for stop_id in stop_ids:
-        logger.info(f"Fetching trips for stop {stop_id} on date {api_date}")
-        
-        df_trips = get_trips_data(stop_id, api_date)
-        send_trips_data_to_gcs(client, df_trips, stop_id, api_date)
+    asyncio.run(send_all_data_to_gcs(gcs.client, df_stops, api_date, headers))
 
 def entrypoint():
     """CLI entry point for the script."""
@@ -1,6 +1,5 @@
 import datetime
-import re
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import typer
 from google.cloud import bigquery, storage  # type: ignore
@@ -9,15 +8,54 @@ from loguru import logger
 from at_bus_load import entrypoints_params
 from at_bus_load.gcp import ConnectBQ, ConnectGCS, get_token_from_env_var
 
+# Source files of a date are 'stops.parquet' and 'trips_{route_id}.parquet'
+_STOPS_FILE_NAME = 'stops.parquet'
+_TRIPS_FILE_NAME_PREFIX = 'trips_'
+_TRIPS_FILE_NAME_SUFFIX = '.parquet'
+_TRIPS_FILE_NAME_PREFIX_LEN = len(_TRIPS_FILE_NAME_PREFIX)
+_TRIPS_FILE_NAME_SUFFIX_LEN = len(_TRIPS_FILE_NAME_SUFFIX)
+
+# Shared by every load job, the client copies it when it submits a job. The tables
+# are partitioned by day on the ingestion date and created by the first load, each
+# load only replaces the partition of its date. The files are written with the
+# schemas pinned in get_at_api_data, so the tables keep the schema of the first load
+# and no schema_update_options are set: a new field is added there, on purpose
+_PARQUET_LOAD_JOB_CONFIG = bigquery.LoadJobConfig(
+    source_format=bigquery.SourceFormat.PARQUET,
+    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+    create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
+    time_partitioning=bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field="api_date_ingestion"
+    )
+)
+
+
+def _partition_table_id(table_name: str, exec_date: str) -> str:
+    """
+    Build the ID of the daily partition of a table, with a partition decorator.
+
+    Args:
+        table_name: The name of the partitioned table.
+        exec_date: The date of the partition, in YYYY-MM-DD format.
+
+    Returns:
+        The table ID with its partition decorator, e.g. 'trips$20240101'.
+    """
+    return f"{table_name}${exec_date.replace('-', '')}"
 
-def move_parquet_file_to_bq_dataset(
+
+def submit_parquet_load(
     bq_client: bigquery.Client,
     dataset_id: str,
     table_id: str,
     source_uri: str
-) -> None:
+) -> bigquery.LoadJob:
     """
-    Loads a Parquet file from Google Cloud Storage into a BigQuery dataset.
+    Starts loading a Parquet file from Google Cloud Storage into a BigQuery dataset.
+
+    The load job is submitted without waiting for it to complete, so several jobs
+    can run at the same time.
 
     Args:
         bq_client: An instance of the BigQuery client.
@@ -26,131 +64,148 @@ def move_parquet_file_to_bq_dataset(
         source_uri: The URI of the source Parquet file in Google Cloud Storage.
 
     Returns:
-        None
+        bigquery.LoadJob: The submitted load job.
     """
 
-    table_ref = bq_client.dataset(dataset_id).table(table_id)
+    # A fully qualified table ID, parsed by the client, avoids building the
+    # dataset and table reference objects
+    table_ref = f"{bq_client.project}.{dataset_id}.{table_id}"
 
     # Load the Parquet file into BigQuery
-    job_config = bigquery.LoadJobConfig(
-        source_format=bigquery.SourceFormat.PARQUET,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
-    )
-
-    logger.info(f"Loading '{source_uri}' into '{dataset_id}.{table_id}'")
-    load_job = bq_client.load_table_from_uri(
-        source_uri, table_ref, job_config=job_config
+    logger.info("Loading '{}' into '{}.{}'", source_uri, dataset_id, table_id)
+    return bq_client.load_table_from_uri(
+        source_uri, table_ref, job_config=_PARQUET_LOAD_JOB_CONFIG
     )
 
-    # Wait for the load job to complete
-    load_job.result()
 
-def move_stops_data_to_bq(
-    bq_client: bigquery.Client,
-    source_bucket_name: str,
-    exec_date: str
-) -> None:
+def _stops_load_args(source_bucket_name: str, exec_date: str) -> Tuple[str, str, str]:
     """
-    Loads a Parquet file from Google Cloud Storage into a BigQuery dataset.
-
-    This function assumes that the Parquet file is located at
-    `gs://{source_bucket_name}/{date}/stops.parquet`.
-
-    The data is loaded into the BigQuery dataset `at_bus_bronze` with a table name
-    that is the same as the date in the source URI.
+    Build the destination and source of the stops load of a date.
 
     Args:
-        bq_client: An instance of the BigQuery client.
-        source_bucket_name: The name of the Google Cloud Storage bucket containing
-            the source Parquet file.
-        exec_date: The date of the data in the source Parquet file.
+        source_bucket_name: The name of the source bucket.
+        exec_date: The date of the data to be processed.
 
     Returns:
-        None
+        The dataset ID, table ID and source URI of the load.
     """
-    source_file_name = f'{exec_date}/stops.parquet'
+    source_file_name = f'{exec_date}/{_STOPS_FILE_NAME}'
 
     # Define the destination BigQuery dataset and table
     dataset_id = 'at_bus_bronze'
-    table_id = f'stops_{exec_date}'
+    table_id = _partition_table_id('stops', exec_date)
 
     # Create a reference to the source Parquet file
     source_uri = f'gs://{source_bucket_name}/{source_file_name}'
 
-    move_parquet_file_to_bq_dataset(bq_client, dataset_id, table_id, source_uri)
+    return dataset_id, table_id, source_uri
     
 
-def get_all_route_id_from_trips_file_name(
-    gcs_client: storage.Client,
-    source_bucket_name: str,
-    exec_date: str
-) -> List[str]:
+def _route_id_from_trips_file_name(blob_name: str) -> Optional[str]:
     """
-    Get a list of all route IDs from the trips file names in the source bucket.
-    
+    Extract the route ID from a trips blob name.
+
+    The file name is a fixed prefix and suffix around the route ID, so plain
+    string checks are enough.
+
     Args:
-        gcs_client: The GCS client instance.
-        source_bucket_name: The name of the source bucket.
-        exec_date: The date of the data to be processed.
-    
+        blob_name: The name of the blob, with or without its folder.
+
     Returns:
-        A list of route IDs.
+        The route ID, or None if the blob is not a trips file.
     """
-
-    bucket = gcs_client.get_bucket(f"{source_bucket_name}")
+    start = blob_name.rfind('/') + 1
     
-    # Get a list of all blobs in the source bucket with the given prefix
-    blobs = list(bucket.list_blobs(prefix=f"{exec_date}"))
+    if (
+        blob_name.startswith(_TRIPS_FILE_NAME_PREFIX, start)
+        and blob_name.endswith(_TRIPS_FILE_NAME_SUFFIX)
+        and len(blob_name) - start > _TRIPS_FILE_NAME_PREFIX_LEN + _TRIPS_FILE_NAME_SUFFIX_LEN
+    ):
+        return blob_name[start + _TRIPS_FILE_NAME_PREFIX_LEN:-_TRIPS_FILE_NAME_SUFFIX_LEN]
+    return None
 
-    route_ids = []
-    
-    # Iterate over each blob and extract the route ID from the file name
-    for blob in blobs:
-        blob_name = blob.name.rsplit('/', 1)[-1]
-        
-        # Use a regular expression to search for the route ID in the file name
-        search_regex = re.search(r'trips_(.*)\.parquet', blob_name)
-        if search_regex:
-            # If the route ID is found, add it to the list
-            route_ids.append(search_regex.group(1))
-    
-    return route_ids
-    
-def move_trips_data_to_bq(
+
+def find_source_files(
     gcs_client: storage.Client,
-    bq_client: bigquery.Client,
     source_bucket_name: str,
     exec_date: str
-) -> None:
-    
+) -> Tuple[bool, bool]:
     """
-    Move trips data from GCS to BigQuery.
+    Check which source files exist for a date, with a single listing.
 
-    This function takes all the Parquet files in the source GCS bucket with the
-    given date and moves them to BigQuery as separate tables.
+    Blobs are listed in name order, so the listing stops as soon as the stops
+    file and a first trips file have been seen.
 
     Args:
         gcs_client: The GCS client instance.
-        bq_client: The BigQuery client instance.
         source_bucket_name: The name of the source bucket.
-        date: The date of the data to be processed.
+        exec_date: The date of the data to be processed.
+
+    Returns:
+        A tuple with whether the stops file exists and whether at least one
+        trips file exists.
     """
-    dataset_id = 'at_bus_bronze'
+    has_stops = False
+    has_trips = False
+    stops_blob_name = f"{exec_date}/{_STOPS_FILE_NAME}"
     
-    route_ids: List[str] = get_all_route_id_from_trips_file_name(
-        gcs_client,
+    blobs = gcs_client.list_blobs(
         source_bucket_name,
-        exec_date
+        prefix=f"{exec_date}/",
+        fields="items(name),nextPageToken"
     )
+    for blob in blobs:
+        if blob.name == stops_blob_name:
+            has_stops = True
+        elif _route_id_from_trips_file_name(blob.name) is not None:
+            has_trips = True
+        
+        if has_stops and has_trips:
+            break
     
-    for route_id in route_ids:
-        source_file_name = f'{exec_date}/trips_{route_id}.parquet'
-        table_id = f'trips_{route_id}_{exec_date}'
+    return has_stops, has_trips
+
+
+def _trips_load_args(source_bucket_name: str, exec_date: str) -> Tuple[str, str, str]:
+    """
+    Build the destination and source of the trips load of a date.
+
+    Args:
+        source_bucket_name: The name of the source bucket.
+        exec_date: The date of the data to be processed.
+
+    Returns:
+        The dataset ID, table ID and source URI of the load.
+    """
+    dataset_id = 'at_bus_bronze'
+    table_id = _partition_table_id('trips', exec_date)
+
+    # Create a reference to every trips Parquet file of the date
+    source_uri = f'gs://{source_bucket_name}/{exec_date}/{_TRIPS_FILE_NAME_PREFIX}*{_TRIPS_FILE_NAME_SUFFIX}'
+
+    return dataset_id, table_id, source_uri
 
-        # Create a reference to the source Parquet file
-        source_uri = f'gs://{source_bucket_name}/{source_file_name}'
 
-        move_parquet_file_to_bq_dataset(bq_client, dataset_id, table_id, source_uri)
+def wait_for_load_jobs(load_jobs: List[bigquery.LoadJob]) -> None:
+    """
+    Wait for several load jobs to complete, from a single thread.
+
+    The jobs already run concurrently in BigQuery, so waiting on them one after
+    the other takes as long as the slowest of them. Each result() call polls its
+    job until it is done.
+
+    The jobs are waited for in order, so the failure of a later job is only raised
+    once every earlier job has finished. That is intended: every load of the date
+    is awaited before the run ends either way.
+
+    Args:
+        load_jobs: The submitted load jobs.
+
+    Raises:
+        google.api_core.exceptions.GoogleAPICallError: If a load job fails.
+    """
+    for load_job in load_jobs:
+        load_job.result()
 
 
 def main(
@@ -167,13 +222,13 @@ def main(
     Main entry point for the script.
 
     This function sets up credentials and client instances, determines the current
-    date, and moves the stops and trips data from GCS to BigQuery.
+    date, and moves the stops and trips data from GCS to BigQuery concurrently.
     """
     
     entrypoints_params.validate_date(date)
     exec_date = date
     
-    logger.info(f"Moving data from GCS to for date: {exec_date}")
+    logger.info("Moving data from GCS to for date: {}", exec_date)
     
     
     token = get_token_from_env_var(env_var_token)
@@ -182,8 +237,26 @@ def main(
     
     source_bucket_name = 'at-bus-open-data'
     
-    move_stops_data_to_bq(client_bq, source_bucket_name, exec_date)
-    move_trips_data_to_bq(client_gcs, client_bq, source_bucket_name, exec_date)
+    # One listing tells which loads have a source file, so no load job is
+    # submitted for a missing file
+    has_stops, has_trips = find_source_files(client_gcs, source_bucket_name, exec_date)
+    if not has_stops:
+        logger.warning("No stops data to move for date: {}", exec_date)
+    if not has_trips:
+        logger.info("No trips data to move for date: {}", exec_date)
+    
+    # The stops and trips loads run at the same time in BigQuery
+    load_jobs: List[bigquery.LoadJob] = []
+    if has_stops:
+        load_jobs.append(
+            submit_parquet_load(client_bq, *_stops_load_args(source_bucket_name, exec_date))
+        )
+    if has_trips:
+        load_jobs.append(
+            submit_parquet_load(client_bq, *_trips_load_args(source_bucket_name, exec_date))
+        )
+    
+    wait_for_load_jobs(load_jobs)
 
 
 def entrypoint():
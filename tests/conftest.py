@@ -1,12 +1,34 @@
 """
 Common fixtures for pytest tests.
 """
+import functools
+import importlib
+import json
 import os
+from types import SimpleNamespace
 from unittest.mock import Mock, patch
 
 import polars as pl
 import pytest
-from google.cloud import bigquery, storage
+
+from at_bus_load.gcp import _reset_default_credentials
+from at_bus_load.get_at_api_data import get_at_api_key
+
+
+@pytest.fixture(autouse=True)
+def clear_at_api_key_cache():
+    """Clear the cached AT API key so each test reads the environment again."""
+    get_at_api_key.cache_clear()
+    yield
+    get_at_api_key.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_default_credentials():
+    """Clear the cached GCP credentials and clients between tests."""
+    _reset_default_credentials()
+    yield
+    _reset_default_credentials()
 
 
 @pytest.fixture
@@ -42,33 +64,36 @@ def sample_trips_data():
     })
 
 
+@functools.lru_cache(maxsize=None)
+def _spec(module_name, class_name):
+    """Attribute names of a Google Cloud class, listed once and shared by every mock."""
+    return dir(getattr(importlib.import_module(module_name), class_name))
+
+
 @pytest.fixture
 def mock_storage_client():
-    """Mock Google Cloud Storage client."""
-    mock_client = Mock(spec=storage.Client)
-    mock_bucket = Mock()
-    mock_blob = Mock()
-    
-    mock_client.bucket.return_value = mock_bucket
+    """Stub Google Cloud Storage client, with only the methods used by the code."""
+    # The bucket and blob only accept attributes of the real classes, to catch API drift
+    mock_bucket = Mock(spec=_spec("google.cloud.storage", "Bucket"))
+    mock_blob = Mock(spec=_spec("google.cloud.storage", "Blob"))
     mock_bucket.blob.return_value = mock_blob
-    mock_client.get_bucket.return_value = mock_bucket
     
-    return mock_client
+    return SimpleNamespace(
+        bucket=Mock(return_value=mock_bucket),
+        get_bucket=Mock(return_value=mock_bucket),
+        list_blobs=Mock(return_value=[])
+    )
 
 
 @pytest.fixture
 def mock_bigquery_client():
-    """Mock Google BigQuery client."""
-    mock_client = Mock(spec=bigquery.Client)
-    mock_dataset = Mock()
-    mock_table = Mock()
-    mock_job = Mock()
-    
-    mock_client.dataset.return_value = mock_dataset
-    mock_dataset.table.return_value = mock_table
-    mock_client.load_table_from_uri.return_value = mock_job
+    """Stub Google BigQuery client, with only the attributes used by the code."""
+    mock_job = Mock(spec=_spec("google.cloud.bigquery", "LoadJob"))
     
-    return mock_client
+    return SimpleNamespace(
+        project="test-project",
+        load_table_from_uri=Mock(return_value=mock_job)
+    )
 
 
 @pytest.fixture
@@ -76,7 +101,7 @@ def mock_requests_response():
     """Mock requests response for API testing."""
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.json.return_value = {
+    mock_response.raw.read.return_value = json.dumps({
         "data": [
             {
                 "stop_id": "8147",
@@ -86,7 +111,7 @@ def mock_requests_response():
                 "stop_lon": 174.7633
             }
         ]
-    }
+    }).encode()
     mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
     return mock_response
 
@@ -99,16 +124,27 @@ def mock_gcp_credentials():
     return mock_creds
 
 
+@pytest.fixture
+def mock_default_credentials(mock_gcp_credentials):
+    """Patch the default credentials lookup to return mock GCP credentials."""
+    with patch('at_bus_load.gcp.google.auth.default') as mock_default:
+        mock_default.return_value = (mock_gcp_credentials, "test-project")
+        yield mock_gcp_credentials
+
+
+@functools.lru_cache(maxsize=None)
+def _create_gcs_blobs(blob_names):
+    """Create blob stubs with the given names, cached across tests."""
+    return tuple(SimpleNamespace(name=blob_name) for blob_name in blob_names)
+
+
 @pytest.fixture
 def mock_gcs_blobs():
     """Helper function to create mock GCS blobs with name attributes."""
     def _create_mock_blobs(blob_names):
         """Create mock blobs with the given names."""
-        mock_blobs = []
-        for blob_name in blob_names:
-            mock_blob = Mock()
-            mock_blob.name = blob_name
-            mock_blobs.append(mock_blob)
-        return mock_blobs
+        # The code under test only reads blob.name, so plain namespaces are enough.
+        # Like the iterator returned by list_blobs, they can only be iterated once
+        return iter(_create_gcs_blobs(tuple(blob_names)))
     
-    return _create_mock_blobs 
\ No newline at end of file
+    return _create_mock_blobs
@@ -1,13 +1,21 @@
 """
 Unit tests for gcp module.
 """
+import datetime
 import os
 from unittest.mock import Mock, patch
 
+import google.auth.exceptions
+import google.auth.transport.requests
 import pytest
-from google.cloud import bigquery, storage
 
-from at_bus_load.gcp import ConnectBQ, ConnectGCS, get_gcp_token_from_default_credentials, get_token_from_env_var
+from at_bus_load.gcp import (
+    ConnectBQ,
+    ConnectGCS,
+    _pooled_session,
+    get_gcp_token_from_default_credentials,
+    get_token_from_env_var
+)
 
 
 class TestGetGcpTokenFromDefaultCredentials:
@@ -35,12 +43,50 @@ class TestGetGcpTokenFromDefaultCredentials:
     @patch('at_bus_load.gcp.google.auth.default')
     def test_get_gcp_token_from_default_credentials_exception(self, mock_default):
         """Test exception handling in get_gcp_token_from_default_credentials."""
-        mock_default.side_effect = Exception("Authentication failed")
+        mock_default.side_effect = google.auth.exceptions.DefaultCredentialsError("Authentication failed")
         
-        with pytest.raises(Exception, match="Authentication failed"):
+        with pytest.raises(google.auth.exceptions.DefaultCredentialsError, match="Authentication failed"):
             get_gcp_token_from_default_credentials()
 
 
+    @patch('at_bus_load.gcp.google.auth.default')
+    @patch('at_bus_load.gcp.google.auth.transport.requests.Request')
+    def test_get_gcp_token_reuses_valid_credentials(self, mock_request, mock_default):
+        """Test that credentials far from expiry are loaded and refreshed only once."""
+        mock_creds = Mock()
+        mock_creds.token = None
+
+        def refresh(_request):
+            mock_creds.token = "fresh-token"
+            mock_creds.expiry = datetime.datetime.now(datetime.timezone.utc).replace(
+                tzinfo=None
+            ) + datetime.timedelta(hours=1)
+
+        mock_creds.refresh.side_effect = refresh
+        mock_default.return_value = (mock_creds, None)
+        
+        assert get_gcp_token_from_default_credentials() == "fresh-token"
+        assert get_gcp_token_from_default_credentials() == "fresh-token"
+        
+        mock_default.assert_called_once()
+        mock_creds.refresh.assert_called_once()
+
+    @patch('at_bus_load.gcp.google.auth.default')
+    @patch('at_bus_load.gcp.google.auth.transport.requests.Request')
+    def test_get_gcp_token_refreshes_credentials_near_expiry(self, mock_request, mock_default):
+        """Test that credentials expiring within the margin are refreshed."""
+        mock_creds = Mock()
+        mock_creds.token = "old-token"
+        mock_creds.expiry = datetime.datetime.now(datetime.timezone.utc).replace(
+            tzinfo=None
+        ) + datetime.timedelta(minutes=1)
+        mock_default.return_value = (mock_creds, None)
+        
+        get_gcp_token_from_default_credentials()
+        
+        mock_creds.refresh.assert_called_once()
+
+
 class TestGetTokenFromEnvVar:
     """Test cases for get_token_from_env_var function."""
 
@@ -66,6 +112,32 @@ class TestGetTokenFromEnvVar:
             assert result is None
 
 
+class TestPooledSession:
+    """Test cases for _pooled_session function."""
+
+    def test_pooled_session(self, mock_gcp_credentials):
+        """Test that HTTPS requests of the session go through a larger pool with retries."""
+        session = _pooled_session(mock_gcp_credentials)
+        
+        assert isinstance(session, google.auth.transport.requests.AuthorizedSession)
+        assert session.credentials is mock_gcp_credentials
+        adapter = session.get_adapter("https://storage.googleapis.com")
+        assert adapter._pool_maxsize == 32
+        assert adapter.max_retries.total == 3
+
+    @patch('at_bus_load.gcp.storage.Client')
+    @patch('google.cloud.bigquery.Client')
+    def test_clients_use_pooled_session(self, mock_bq_client, mock_gcs_client):
+        """Test that each client is handed a pooled session authorized with its credentials."""
+        ConnectGCS("test-token-12345").client
+        ConnectBQ("test-token-12345").client
+        
+        for mock_client in (mock_gcs_client, mock_bq_client):
+            kwargs = mock_client.call_args[1]
+            assert kwargs['_http'].credentials is kwargs['credentials']
+            assert kwargs['_http'].get_adapter("https://www.googleapis.com")._pool_maxsize == 32
+
+
 class TestConnectGCS:
     """Test cases for ConnectGCS class."""
 
@@ -76,6 +148,10 @@ class TestConnectGCS:
         
         connect_gcs = ConnectGCS(token)
         
+        # The client is only built on first access
+        mock_storage_client.assert_not_called()
+        connect_gcs.client
+        
         # Verify storage.Client was called with credentials
         mock_storage_client.assert_called_once()
         call_args = mock_storage_client.call_args
@@ -85,40 +161,50 @@ class TestConnectGCS:
         assert connect_gcs.client == mock_storage_client()
 
     @patch('at_bus_load.gcp.storage.Client')
-    def test_connect_gcs_without_token(self, mock_storage_client):
+    def test_connect_gcs_without_token(self, mock_storage_client, mock_default_credentials):
         """Test GCS connection without token (using default credentials)."""
         connect_gcs = ConnectGCS()
         
-        # Verify storage.Client was called without credentials
+        # The client is only built on first access
+        mock_storage_client.assert_not_called()
+        connect_gcs.client
+        
+        # Verify storage.Client was called with the default credentials
         mock_storage_client.assert_called_once()
         call_args = mock_storage_client.call_args
-        assert call_args[1]['credentials'] is None
+        assert call_args[1]['credentials'] is mock_default_credentials
         
         # Verify the client property returns the mock client
         assert connect_gcs.client == mock_storage_client()
 
     @patch('at_bus_load.gcp.storage.Client')
-    def test_connect_gcs_with_none_token(self, mock_storage_client):
+    def test_connect_gcs_with_none_token(self, mock_storage_client, mock_default_credentials):
         """Test GCS connection with None token."""
         connect_gcs = ConnectGCS(None)
         
-        # Verify storage.Client was called without credentials
+        # The client is only built on first access
+        mock_storage_client.assert_not_called()
+        connect_gcs.client
+        
+        # Verify storage.Client was called with the default credentials
         mock_storage_client.assert_called_once()
         call_args = mock_storage_client.call_args
-        assert call_args[1]['credentials'] is None
+        assert call_args[1]['credentials'] is mock_default_credentials
         
         # Verify the client property returns the mock client
         assert connect_gcs.client == mock_storage_client()
 
     @patch('at_bus_load.gcp.storage.Client')
-    def test_connect_gcs_exception_handling(self, mock_storage_client):
+    def test_connect_gcs_exception_handling(self, mock_storage_client, mock_default_credentials):
         """Test exception handling in ConnectGCS."""
-        mock_storage_client.side_effect = Exception("Connection failed")
+        mock_storage_client.side_effect = OSError("Project was not passed and could not be determined from the environment.")
+        
+        connect_gcs = ConnectGCS()
         
-        with pytest.raises(Exception, match="Connection failed"):
-            ConnectGCS()
+        with pytest.raises(OSError, match="Project was not passed"):
+            connect_gcs.client
 
-    def test_connect_gcs_client_property(self):
+    def test_connect_gcs_client_property(self, mock_default_credentials):
         """Test the client property of ConnectGCS."""
         with patch('at_bus_load.gcp.storage.Client') as mock_storage_client:
             mock_client_instance = Mock()
@@ -129,17 +215,32 @@ class TestConnectGCS:
             # Verify the client property returns the correct instance
             assert connect_gcs.client is mock_client_instance
 
+    @patch('at_bus_load.gcp.storage.Client')
+    def test_connect_gcs_reuses_client(self, mock_storage_client):
+        """Test that connections with the same token share one storage client."""
+        first = ConnectGCS("test-token-12345")
+        second = ConnectGCS("test-token-12345")
+        ConnectGCS("other-token").client
+        
+        assert first.client is second.client
+        # One client for each distinct token
+        assert mock_storage_client.call_count == 2
+
 
 class TestConnectBQ:
     """Test cases for ConnectBQ class."""
 
-    @patch('at_bus_load.gcp.bigquery.Client')
+    @patch('google.cloud.bigquery.Client')
     def test_connect_bq_with_token(self, mock_bigquery_client):
         """Test BigQuery connection with token authentication."""
         token = "test-token-12345"
         
         connect_bq = ConnectBQ(token)
         
+        # The client is only built on first access
+        mock_bigquery_client.assert_not_called()
+        connect_bq.client
+        
         # Verify bigquery.Client was called with credentials
         mock_bigquery_client.assert_called_once()
         call_args = mock_bigquery_client.call_args
@@ -148,43 +249,53 @@ class TestConnectBQ:
         # Verify the client property returns the mock client
         assert connect_bq.client == mock_bigquery_client()
 
-    @patch('at_bus_load.gcp.bigquery.Client')
-    def test_connect_bq_without_token(self, mock_bigquery_client):
+    @patch('google.cloud.bigquery.Client')
+    def test_connect_bq_without_token(self, mock_bigquery_client, mock_default_credentials):
         """Test BigQuery connection without token (using default credentials)."""
         connect_bq = ConnectBQ()
         
-        # Verify bigquery.Client was called without credentials
+        # The client is only built on first access
+        mock_bigquery_client.assert_not_called()
+        connect_bq.client
+        
+        # Verify bigquery.Client was called with the default credentials
         mock_bigquery_client.assert_called_once()
         call_args = mock_bigquery_client.call_args
-        assert call_args[1]['credentials'] is None
+        assert call_args[1]['credentials'] is mock_default_credentials
         
         # Verify the client property returns the mock client
         assert connect_bq.client == mock_bigquery_client()
 
-    @patch('at_bus_load.gcp.bigquery.Client')
-    def test_connect_bq_with_none_token(self, mock_bigquery_client):
+    @patch('google.cloud.bigquery.Client')
+    def test_connect_bq_with_none_token(self, mock_bigquery_client, mock_default_credentials):
         """Test BigQuery connection with None token."""
         connect_bq = ConnectBQ(None)
         
-        # Verify bigquery.Client was called without credentials
+        # The client is only built on first access
+        mock_bigquery_client.assert_not_called()
+        connect_bq.client
+        
+        # Verify bigquery.Client was called with the default credentials
         mock_bigquery_client.assert_called_once()
         call_args = mock_bigquery_client.call_args
-        assert call_args[1]['credentials'] is None
+        assert call_args[1]['credentials'] is mock_default_credentials
         
         # Verify the client property returns the mock client
         assert connect_bq.client == mock_bigquery_client()
 
-    @patch('at_bus_load.gcp.bigquery.Client')
-    def test_connect_bq_exception_handling(self, mock_bigquery_client):
+    @patch('google.cloud.bigquery.Client')
+    def test_connect_bq_exception_handling(self, mock_bigquery_client, mock_default_credentials):
         """Test exception handling in ConnectBQ."""
-        mock_bigquery_client.side_effect = Exception("Connection failed")
+        mock_bigquery_client.side_effect = OSError("Project was not passed and could not be determined from the environment.")
         
-        with pytest.raises(Exception, match="Connection failed"):
-            ConnectBQ()
+        connect_bq = ConnectBQ()
+        
+        with pytest.raises(OSError, match="Project was not passed"):
+            connect_bq.client
 
-    def test_connect_bq_client_property(self):
+    def test_connect_bq_client_property(self, mock_default_credentials):
         """Test the client property of ConnectBQ."""
-        with patch('at_bus_load.gcp.bigquery.Client') as mock_bigquery_client:
+        with patch('google.cloud.bigquery.Client') as mock_bigquery_client:
             mock_client_instance = Mock()
             mock_bigquery_client.return_value = mock_client_instance
             
@@ -193,12 +304,21 @@ class TestConnectBQ:
             # Verify the client property returns the correct instance
             assert connect_bq.client is mock_client_instance
 
+    @patch('google.cloud.bigquery.Client')
+    def test_connect_bq_reuses_client(self, mock_bigquery_client, mock_default_credentials):
+        """Test that connections with the same token share one BigQuery client."""
+        first = ConnectBQ()
+        second = ConnectBQ(None)
+        
+        assert first.client is second.client
+        mock_bigquery_client.assert_called_once()
+
 
 class TestIntegrationScenarios:
     """Integration test scenarios for the gcp module."""
 
     @patch('at_bus_load.gcp.storage.Client')
-    @patch('at_bus_load.gcp.bigquery.Client')
+    @patch('google.cloud.bigquery.Client')
     def test_gcs_and_bq_connection_workflow(self, mock_bq_client, mock_gcs_client):
         """Test the workflow of connecting to both GCS and BigQuery."""
         # Set up mock return values
@@ -222,7 +342,7 @@ class TestIntegrationScenarios:
     @patch('at_bus_load.gcp.google.auth.default')
     @patch('at_bus_load.gcp.google.auth.transport.requests.Request')
     @patch('at_bus_load.gcp.storage.Client')
-    @patch('at_bus_load.gcp.bigquery.Client')
+    @patch('google.cloud.bigquery.Client')
     def test_full_authentication_workflow(
         self, mock_bq_client, mock_gcs_client, mock_request, mock_default, mock_gcp_credentials
     ):
@@ -255,28 +375,49 @@ class TestIntegrationScenarios:
         mock_bq_client.assert_called_once()
 
 
+    @patch('at_bus_load.gcp.storage.Client')
+    @patch('google.cloud.bigquery.Client')
+    def test_gcs_and_bq_share_token_credentials(self, mock_bq_client, mock_gcs_client):
+        """Test that clients built from the same token share one credentials object."""
+        ConnectGCS("shared-token").client
+        ConnectBQ("shared-token").client
+        
+        gcs_creds = mock_gcs_client.call_args[1]['credentials']
+        bq_creds = mock_bq_client.call_args[1]['credentials']
+        assert gcs_creds is bq_creds
+        assert gcs_creds.token == "shared-token"
+
+
 class TestEdgeCases:
     """Test edge cases and error conditions."""
 
     @patch('at_bus_load.gcp.storage.Client')
-    def test_connect_gcs_empty_token_string(self, mock_storage_client):
+    def test_connect_gcs_empty_token_string(self, mock_storage_client, mock_default_credentials):
         """Test GCS connection with empty token string."""
         connect_gcs = ConnectGCS("")
         
+        # The client is only built on first access
+        mock_storage_client.assert_not_called()
+        connect_gcs.client
+        
         # Should treat empty string as no token
         mock_storage_client.assert_called_once()
         call_args = mock_storage_client.call_args
-        assert call_args[1]['credentials'] is None
+        assert call_args[1]['credentials'] is mock_default_credentials
 
-    @patch('at_bus_load.gcp.bigquery.Client')
-    def test_connect_bq_empty_token_string(self, mock_bigquery_client):
+    @patch('google.cloud.bigquery.Client')
+    def test_connect_bq_empty_token_string(self, mock_bigquery_client, mock_default_credentials):
         """Test BigQuery connection with empty token string."""
         connect_bq = ConnectBQ("")
         
+        # The client is only built on first access
+        mock_bigquery_client.assert_not_called()
+        connect_bq.client
+        
         # Should treat empty string as no token
         mock_bigquery_client.assert_called_once()
         call_args = mock_bigquery_client.call_args
-        assert call_args[1]['credentials'] is None
+        assert call_args[1]['credentials'] is mock_default_credentials
 
     def test_get_token_from_env_var_empty_string(self, mock_env_vars):
         """Test token retrieval with empty string environment variable."""
@@ -288,8 +429,8 @@ class TestEdgeCases:
     def test_get_gcp_token_credentials_refresh_failure(self, mock_default):
         """Test handling of credential refresh failure."""
         mock_creds = Mock()
-        mock_creds.refresh.side_effect = Exception("Refresh failed")
+        mock_creds.refresh.side_effect = google.auth.exceptions.RefreshError("Refresh failed")
         mock_default.return_value = (mock_creds, None)
         
-        with pytest.raises(Exception, match="Refresh failed"):
+        with pytest.raises(google.auth.exceptions.RefreshError, match="Refresh failed"):
             get_gcp_token_from_default_credentials() 
\ No newline at end of file
@@ -1,21 +1,39 @@
 """
 Unit tests for get_at_api_data module.
 """
+import asyncio
+import datetime
+import io
+import json
 import os
-from unittest.mock import Mock, patch
+import threading
+import tracemalloc
+from unittest.mock import Mock, PropertyMock, patch
 
+import google.api_core.exceptions
 import polars as pl
+import pyarrow.parquet as pq
 import pytest
 import requests
-from google.cloud import storage
+import responses
+from responses import matchers
 
 from at_bus_load.get_at_api_data import (
+    _SESSION,
+    _STOPS_SCHEMA,
+    _TRIPS_SCHEMA,
     filter_stops_data,
+    get_and_send_all_trips_data,
+    get_at_api_headers,
     get_at_api_key,
     get_at_gtfs_data_from_at_mobile_api,
     get_stops_data,
+    get_trips_data,
+    main,
+    send_all_data_to_gcs,
     send_stop_data_to_gcs,
-    send_trips_data_to_gcs
+    send_trips_data_to_gcs,
+    upload_parquet_to_gcs
 )
 
 
@@ -33,11 +51,52 @@ class TestGetAtApiKey:
             with pytest.raises(ValueError, match="Auckland Transport API key not found."):
                 get_at_api_key()
 
+    def test_get_at_api_key_cached(self, mock_env_vars):
+        """Test that the environment is only read on the first call."""
+        with patch('at_bus_load.get_at_api_data.os.getenv', wraps=os.getenv) as mock_getenv:
+            assert get_at_api_key() == "test-api-key-12345"
+            assert get_at_api_key() == "test-api-key-12345"
+        
+        mock_getenv.assert_called_once_with("AT_API_KEY")
+
+
+class TestGetAtApiHeaders:
+    """Test cases for get_at_api_headers function."""
+
+    def test_get_at_api_headers_success(self, mock_env_vars):
+        """Test that the headers contain the API key."""
+        headers = get_at_api_headers()
+        
+        assert headers == {
+            "Cache-Control": "no-cache",
+            "Ocp-Apim-Subscription-Key": "test-api-key-12345"
+        }
+
+
+class TestSession:
+    """Test cases for the shared AT API session."""
+
+    def test_session_https_adapter(self):
+        """Test that HTTPS requests go through a pooled adapter with retries."""
+        adapter = _SESSION.get_adapter("https://api.at.govt.nz/gtfs/v3/stops")
+        
+        assert adapter._pool_maxsize == 16
+        assert adapter.max_retries.total == 3
+        assert adapter.max_retries.status_forcelist == [429, 500, 502, 503, 504]
+        assert adapter.max_retries.raise_on_status is False
+
+    def test_session_reuses_adapter(self):
+        """Test that every AT API call goes through the same connection pool."""
+        first = _SESSION.get_adapter("https://api.at.govt.nz/gtfs/v3/stops")
+        second = _SESSION.get_adapter("https://api.at.govt.nz/gtfs/v3/stops/8147/stoptrips")
+        
+        assert first is second
+
 
 class TestGetAtGtfsDataFromAtMobileApi:
     """Test cases for get_at_gtfs_data_from_at_mobile_api function."""
 
-    @patch('at_bus_load.get_at_api_data.requests.get')
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
     def test_get_at_gtfs_data_success(self, mock_get, mock_requests_response):
         """Test successful API data retrieval."""
         mock_get.return_value = mock_requests_response
@@ -47,7 +106,7 @@ class TestGetAtGtfsDataFromAtMobileApi:
         assert isinstance(result, pl.DataFrame)
         assert len(result) == 1
 
-    @patch('at_bus_load.get_at_api_data.requests.get')
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
     def test_get_at_gtfs_data_with_params_and_headers(self, mock_get, mock_requests_response):
         """Test API call with custom parameters and headers."""
         mock_get.return_value = mock_requests_response
@@ -60,11 +119,13 @@ class TestGetAtGtfsDataFromAtMobileApi:
         mock_get.assert_called_once_with(
             "https://api.at.govt.nz/gtfs/v3/stops",
             params=params,
-            headers=headers
+            headers=headers,
+            stream=True,
+            timeout=(5, 30)
         )
         assert isinstance(result, pl.DataFrame)
 
-    @patch('at_bus_load.get_at_api_data.requests.get')
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
     def test_get_at_gtfs_data_api_error(self, mock_get):
         """Test handling of API errors."""
         mock_response = Mock()
@@ -76,12 +137,12 @@ class TestGetAtGtfsDataFromAtMobileApi:
         with pytest.raises(Exception, match="Request failed with status code 404: Not Found"):
             get_at_gtfs_data_from_at_mobile_api("stops")
 
-    @patch('at_bus_load.get_at_api_data.requests.get')
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
     def test_get_at_gtfs_data_with_nested_columns(self, mock_get):
         """Test handling of nested JSON structures."""
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.json.return_value = {
+        mock_response.raw.read.return_value = json.dumps({
             "data": [
                 {
                     "stop_id": "8147",
@@ -91,7 +152,7 @@ class TestGetAtGtfsDataFromAtMobileApi:
                     }
                 }
             ]
-        }
+        }).encode()
         mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
         mock_get.return_value = mock_response
         
@@ -102,7 +163,117 @@ class TestGetAtGtfsDataFromAtMobileApi:
         assert "lat" in result.columns
         assert "lon" in result.columns
 
-    @patch('at_bus_load.get_at_api_data.requests.get')
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
+    def test_get_at_gtfs_data_with_several_nested_columns(self, mock_get):
+        """Test that all nested columns are unnested."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.read.return_value = json.dumps({
+            "data": [
+                {
+                    "id": "8147-1",
+                    "type": "stop",
+                    "attributes": {"stop_code": "8147", "stop_name": "Test Stop"},
+                    "location": {"lat": -36.8485, "lon": 174.7633}
+                }
+            ]
+        }).encode()
+        mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
+        mock_get.return_value = mock_response
+        
+        result = get_at_gtfs_data_from_at_mobile_api("stops")
+        
+        assert result.columns == ["id", "type", "stop_code", "stop_name", "lat", "lon"]
+
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
+    def test_get_at_gtfs_data_with_missing_keys(self, mock_get):
+        """Test that keys missing from some records are filled with nulls."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.read.return_value = json.dumps({
+            "data": [
+                {"id": "1", "attributes": {"stop_code": "8147", "platform_code": "A"}},
+                {"id": "2", "attributes": {"stop_code": "8545"}}
+            ]
+        }).encode()
+        mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
+        mock_get.return_value = mock_response
+        
+        result = get_at_gtfs_data_from_at_mobile_api("stops")
+        
+        assert result["stop_code"].to_list() == ["8147", "8545"]
+        assert result["platform_code"].to_list() == ["A", None]
+
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
+    def test_get_at_gtfs_data_empty_response(self, mock_get):
+        """Test that an empty 'data' list returns an empty DataFrame."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.read.return_value = json.dumps({"data": []}).encode()
+        mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
+        mock_get.return_value = mock_response
+        
+        result = get_at_gtfs_data_from_at_mobile_api("stops")
+        
+        assert isinstance(result, pl.DataFrame)
+        assert result.is_empty()
+
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
+    def test_get_at_gtfs_data_ignores_top_level_keys(self, mock_get):
+        """Test that only the 'data' records are turned into rows."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.read.return_value = json.dumps({
+            "data": [{"id": "1"}, {"id": "2"}],
+            "links": {"self": "https://api.at.govt.nz/gtfs/v3/stops"},
+            "meta": {"count": 2}
+        }).encode()
+        mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
+        mock_get.return_value = mock_response
+        
+        result = get_at_gtfs_data_from_at_mobile_api("stops")
+        
+        assert result.columns == ["id"]
+        assert result["id"].to_list() == ["1", "2"]
+
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
+    def test_get_at_gtfs_data_missing_data_key(self, mock_get):
+        """Test that a response without a 'data' key raises a KeyError."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.read.return_value = json.dumps({"errors": ["Bad filter"]}).encode()
+        mock_response.url = "https://api.at.govt.nz/gtfs/v3/stops"
+        mock_get.return_value = mock_response
+        
+        with pytest.raises(KeyError):
+            get_at_gtfs_data_from_at_mobile_api("stops")
+
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
+    def test_get_at_gtfs_data_large_response_memory(self, mock_get):
+        """Test that parsing a large response does not build Python objects per record."""
+        records = [
+            {"id": f"trip_{i}", "type": "trip", "attributes": {"trip_id": f"trip_{i}", "stop_sequence": i}}
+            for i in range(10_000)
+        ]
+        body = json.dumps({"data": records}).encode()
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.read.return_value = body
+        mock_response.url = "https://api.at.govt.nz/gtfs/v3/trips"
+        mock_get.return_value = mock_response
+        
+        tracemalloc.start()
+        try:
+            result = get_at_gtfs_data_from_at_mobile_api("trips")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        assert result.shape == (10_000, 4)
+        # Decoding the records into dicts alone would allocate several times the body size
+        assert peak < len(body)
+
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
     def test_get_at_gtfs_data_api_error_500(self, mock_get):
         """Test handling of 500 API errors."""
         mock_response = Mock()
@@ -114,7 +285,7 @@ class TestGetAtGtfsDataFromAtMobileApi:
         with pytest.raises(Exception, match="Request failed with status code 500: Internal Server Error"):
             get_at_gtfs_data_from_at_mobile_api("stops")
 
-    @patch('at_bus_load.get_at_api_data.requests.get')
+    @patch('at_bus_load.get_at_api_data._SESSION.get')
     def test_get_at_gtfs_data_api_error_403(self, mock_get):
         """Test handling of 403 API errors."""
         mock_response = Mock()
@@ -127,6 +298,39 @@ class TestGetAtGtfsDataFromAtMobileApi:
             get_at_gtfs_data_from_at_mobile_api("stops")
 
 
+class TestGetAtGtfsDataOverHttp:
+    """Test cases for get_at_gtfs_data_from_at_mobile_api through the shared session."""
+
+    @responses.activate
+    def test_get_at_gtfs_data_streamed_body(self):
+        """Test that the query parameters are sent and the streamed body is parsed."""
+        responses.add(
+            responses.GET,
+            "https://api.at.govt.nz/gtfs/v3/stops",
+            body=json.dumps({"data": [{"id": "8147-1", "attributes": {"stop_code": "8147"}}]}).encode(),
+            status=200,
+            match=[matchers.query_param_matcher({"filter[date]": "2024-01-01"})]
+        )
+        
+        result = get_at_gtfs_data_from_at_mobile_api("stops", params={"filter[date]": "2024-01-01"})
+        
+        assert result.columns == ["id", "stop_code"]
+        assert result["stop_code"].to_list() == ["8147"]
+
+    @responses.activate
+    def test_get_at_gtfs_data_not_found(self):
+        """Test that an error status from the API raises an exception."""
+        responses.add(
+            responses.GET,
+            "https://api.at.govt.nz/gtfs/v3/stops/0000/stoptrips",
+            body="Not Found",
+            status=404
+        )
+        
+        with pytest.raises(Exception, match="Request failed with status code 404: Not Found"):
+            get_at_gtfs_data_from_at_mobile_api("stops/0000/stoptrips")
+
+
 class TestGetStopsData:
     """Test cases for get_stops_data function."""
 
@@ -141,6 +345,9 @@ class TestGetStopsData:
         
         assert isinstance(result, pl.DataFrame)
         assert "api_date_ingestion" in result.columns
+        # The date string is parsed once into a single broadcast Date literal
+        assert result.schema["api_date_ingestion"] == pl.Date
+        assert result.get_column("api_date_ingestion").n_unique() == 1
         
         # Verify the function was called with correct parameters
         mock_get_gtfs_data.assert_called_once_with(
@@ -152,14 +359,80 @@ class TestGetStopsData:
             }
         )
 
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    @patch('at_bus_load.get_at_api_data.get_at_api_key')
+    def test_get_stops_data_with_headers(self, mock_get_api_key, mock_get_gtfs_data, sample_stops_data):
+        """Test that provided headers are used as is."""
+        mock_get_gtfs_data.return_value = sample_stops_data
+        headers = {"Ocp-Apim-Subscription-Key": "provided-key"}
+        
+        get_stops_data("2024-01-01", headers)
+        
+        assert mock_get_gtfs_data.call_args[1]['headers'] is headers
+        mock_get_api_key.assert_not_called()
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_stops_data_pinned_schema(self, mock_get_gtfs_data):
+        """Test that the stops are cast to the pinned schema, whatever dtypes were inferred."""
+        mock_get_gtfs_data.return_value = pl.DataFrame({
+            "stop_code": ["8147", "8545"],
+            "platform_code": [None, None],
+            "location_type": [None, None],
+            "new_field": ["a", "b"]
+        })
+        
+        result = get_stops_data("2024-01-01", {})
+        
+        assert result.schema == pl.Schema({**_STOPS_SCHEMA, "api_date_ingestion": pl.Date})
+        assert result["location_type"].to_list() == [None, None]
+        assert result["stop_code"].to_list() == ["8147", "8545"]
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_stops_data_written_schemas_match(self, mock_get_gtfs_data):
+        """Test that days whose stops differ by an all-null or float column write the same parquet schema."""
+        mock_get_gtfs_data.side_effect = [
+            pl.DataFrame({"stop_code": ["8147"], "wheelchair_boarding": [1], "stop_lat": [-36]}),
+            pl.DataFrame({"stop_code": ["8147"], "wheelchair_boarding": [None], "stop_lat": [-36.8485]})
+        ]
+        
+        schemas = []
+        for api_date in ("2024-01-01", "2024-01-02"):
+            mock_blob = Mock()
+            upload_parquet_to_gcs(get_stops_data(api_date, {}), mock_blob)
+            buffer = mock_blob.upload_from_file.call_args[0][0]
+            schemas.append(pq.read_schema(io.BytesIO(buffer.getvalue())))
+        
+        assert schemas[0] == schemas[1]
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_stops_data_empty(self, mock_get_gtfs_data):
+        """Test that an empty response gives an empty frame with the pinned schema."""
+        mock_get_gtfs_data.return_value = pl.DataFrame()
+        
+        result = get_stops_data("2024-01-01", {})
+        
+        assert result.is_empty()
+        assert "stop_code" in result.columns
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_stops_data_with_date_object(self, mock_get_gtfs_data, sample_stops_data):
+        """Test that a parsed date is used for both the request and the ingestion column."""
+        mock_get_gtfs_data.return_value = sample_stops_data
+        
+        result = get_stops_data(datetime.date(2024, 1, 1), {})
+        
+        assert mock_get_gtfs_data.call_args[1]['params'] == {"filter[date]": "2024-01-01"}
+        assert result.schema["api_date_ingestion"] == pl.Date
+        assert result["api_date_ingestion"].to_list() == [datetime.date(2024, 1, 1)] * len(result)
+
     @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
     @patch('at_bus_load.get_at_api_data.get_at_api_key')
     def test_get_stops_data_exception_handling(self, mock_get_api_key, mock_get_gtfs_data):
         """Test exception handling in get_stops_data."""
         mock_get_api_key.return_value = "test-api-key"
-        mock_get_gtfs_data.side_effect = Exception("API Error")
+        mock_get_gtfs_data.side_effect = requests.ConnectionError("API Error")
         
-        with pytest.raises(Exception, match="API Error"):
+        with pytest.raises(requests.ConnectionError, match="API Error"):
             get_stops_data("2024-01-01")
 
 
@@ -174,6 +447,14 @@ class TestFilterStopsData:
         assert len(result) == 5  # All stops should be included as they're in the predefined list
         assert all(stop_code in ["8147", "8545", "7149", "8331", "7133"] for stop_code in result["stop_code"])
 
+    def test_filter_stops_data_reuses_stop_codes(self, sample_stops_data):
+        """Test that the stop codes are not rebuilt on every call."""
+        with patch.object(pl.Series, "implode") as mock_implode:
+            filter_stops_data(sample_stops_data)
+            filter_stops_data(sample_stops_data)
+        
+        mock_implode.assert_not_called()
+
     def test_filter_stops_data_with_extra_stops(self):
         """Test filtering when DataFrame contains stops not in the predefined list."""
         df_with_extra = pl.DataFrame({
@@ -206,59 +487,334 @@ class TestFilterStopsData:
         # Create a DataFrame that will cause an error when filtering
         invalid_df = "not a dataframe"
         
-        with pytest.raises(Exception):
+        with pytest.raises(AttributeError):
             filter_stops_data(invalid_df)
 
 
+class TestUploadParquetToGcs:
+    """Test cases for upload_parquet_to_gcs function."""
+
+    def test_upload_parquet_to_gcs_success(self, sample_stops_data):
+        """Test that the DataFrame is uploaded as an in-memory Parquet file."""
+        mock_blob = Mock()
+        
+        upload_parquet_to_gcs(sample_stops_data, mock_blob)
+        
+        mock_blob.upload_from_file.assert_called_once()
+        call_args = mock_blob.upload_from_file.call_args
+        buffer = call_args[0][0]
+        assert call_args[1]['size'] == len(buffer.getvalue())
+        assert call_args[1]['content_type'] == "application/octet-stream"
+        
+        # The uploaded bytes should round-trip to the original DataFrame
+        assert pl.read_parquet(buffer).equals(sample_stops_data)
+        
+        # The file should be a single ZSTD-compressed row group
+        metadata = pq.ParquetFile(io.BytesIO(buffer.getvalue())).metadata
+        assert metadata.num_row_groups == 1
+        assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+    def test_upload_parquet_to_gcs_smaller_than_lz4(self):
+        """Test that the uploaded file is smaller than an LZ4-compressed one."""
+        n_rows = 10_000
+        df = pl.DataFrame({
+            "trip_id": [f"trip_{i * 7919 % n_rows}" for i in range(n_rows)],
+            "route_id": [f"route_{i % 80}" for i in range(n_rows)],
+            "trip_headsign": [["Britomart", "Newmarket", "Albany"][i % 3] for i in range(n_rows)],
+            "stop_sequence": [i % 60 for i in range(n_rows)]
+        })
+        mock_blob = Mock()
+        
+        upload_parquet_to_gcs(df, mock_blob)
+        
+        lz4_buffer = io.BytesIO()
+        df.write_parquet(lz4_buffer, compression="lz4", statistics=False)
+        assert mock_blob.upload_from_file.call_args[1]['size'] < lz4_buffer.tell()
+
+
 class TestSendStopDataToGcs:
     """Test cases for send_stop_data_to_gcs function."""
 
     @patch('at_bus_load.get_at_api_data.pl.DataFrame.write_parquet')
     def test_send_stop_data_to_gcs_success(self, mock_write_parquet, mock_storage_client, sample_stops_data):
         """Test successful upload of stops data to GCS."""
+        mock_bucket = mock_storage_client.bucket.return_value
+        mock_blob = mock_bucket.blob.return_value
+        
         send_stop_data_to_gcs(mock_storage_client, sample_stops_data, "2024-01-01")
         
         # Verify the bucket and blob were accessed correctly
         mock_storage_client.bucket.assert_called_once_with("at-bus-open-data")
-        mock_storage_client.bucket().blob.assert_called_once_with("2024-01-01/stops.parquet")
+        mock_bucket.blob.assert_called_once_with("2024-01-01/stops.parquet")
         
-        # Verify the parquet file was written
-        mock_write_parquet.assert_called_once_with("data/stops.parquet")
+        # Verify the parquet file was written in memory
+        mock_write_parquet.assert_called_once()
+        assert isinstance(mock_write_parquet.call_args[0][0], io.BytesIO)
         
         # Verify the blob was uploaded
-        mock_storage_client.bucket().blob().upload_from_filename.assert_called_once_with("data/stops.parquet")
+        mock_blob.upload_from_file.assert_called_once()
 
     def test_send_stop_data_to_gcs_exception_handling(self, mock_storage_client, sample_stops_data):
         """Test exception handling in send_stop_data_to_gcs."""
         # Make the upload fail
-        mock_storage_client.bucket().blob().upload_from_filename.side_effect = Exception("Upload failed")
+        mock_storage_client.bucket.return_value.blob.return_value.upload_from_file.side_effect = google.api_core.exceptions.ServiceUnavailable("Upload failed")
         
-        with pytest.raises(Exception, match="Upload failed"):
+        with pytest.raises(google.api_core.exceptions.ServiceUnavailable, match="Upload failed"):
             send_stop_data_to_gcs(mock_storage_client, sample_stops_data, "2024-01-01")
 
 
+class TestGetTripsData:
+    """Test cases for get_trips_data function."""
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_trips_data_success(self, mock_get_gtfs_data, sample_trips_data):
+        """Test successful trips data retrieval."""
+        mock_get_gtfs_data.return_value = sample_trips_data
+        headers = {"Ocp-Apim-Subscription-Key": "test-api-key"}
+        
+        result = get_trips_data("stop_001", "2024-01-01", headers)
+        
+        assert len(result) == 3
+        assert "api_date_ingestion" in result.columns
+        mock_get_gtfs_data.assert_called_once_with(
+            data_name="stops/stop_001/stoptrips",
+            params={
+                "filter[date]": "2024-01-01",
+                "filter[start_hour]": 3,
+                "filter[hour_range]": 24
+            },
+            headers=headers
+        )
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_trips_data_empty(self, mock_get_gtfs_data):
+        """Test that a stop without trips returns an empty DataFrame."""
+        mock_get_gtfs_data.return_value = pl.DataFrame()
+        
+        result = get_trips_data("stop_001", "2024-01-01", {})
+        
+        assert result.is_empty()
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_trips_data_pinned_schema(self, mock_get_gtfs_data):
+        """Test that the trips are cast to the pinned schema, whatever dtypes were inferred."""
+        mock_get_gtfs_data.return_value = pl.DataFrame({
+            "trip_id": ["trip_001"],
+            "direction_id": [None],
+            "stop_sequence": [3.0]
+        })
+        
+        result = get_trips_data("stop_001", "2024-01-01", {})
+        
+        assert result.schema == pl.Schema({**_TRIPS_SCHEMA, "api_date_ingestion": pl.Date})
+        assert result["stop_sequence"].to_list() == [3]
+
+    @patch('at_bus_load.get_at_api_data.get_at_gtfs_data_from_at_mobile_api')
+    def test_get_trips_data_written_schemas_match(self, mock_get_gtfs_data):
+        """Test that stops whose trips differ by an all-null or float column write the same parquet schema."""
+        mock_get_gtfs_data.side_effect = [
+            pl.DataFrame({"trip_id": ["trip_001"], "direction_id": [1], "trip_headsign": ["Britomart"]}),
+            pl.DataFrame({"trip_id": ["trip_002"], "direction_id": [None], "trip_headsign": [None]}),
+            pl.DataFrame({"trip_id": ["trip_003", "trip_004"], "direction_id": [0.0, 1.5], "trip_headsign": ["A", "B"]})
+        ]
+        
+        schemas = []
+        for stop_id in ("stop_001", "stop_002", "stop_003"):
+            mock_blob = Mock()
+            upload_parquet_to_gcs(get_trips_data(stop_id, "2024-01-01", {}), mock_blob)
+            buffer = mock_blob.upload_from_file.call_args[0][0]
+            schemas.append(pq.read_schema(io.BytesIO(buffer.getvalue())))
+        
+        assert schemas[0] == schemas[1] == schemas[2]
+        assert schemas[0].field("direction_id").type == "int64"
+
+
+class TestGetAndSendAllTripsData:
+    """Test cases for get_and_send_all_trips_data function."""
+
+    @patch('at_bus_load.get_at_api_data.send_trips_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.get_trips_data')
+    def test_get_and_send_all_trips_data_success(self, mock_get_trips_data, mock_send_trips_data, mock_storage_client):
+        """Test that the trips data of every stop is uploaded with the shared client."""
+        mock_get_trips_data.side_effect = lambda stop_id, api_date, headers: pl.DataFrame({"stop": [stop_id]})
+        headers = {"Ocp-Apim-Subscription-Key": "test-api-key"}
+        
+        asyncio.run(get_and_send_all_trips_data(mock_storage_client, ["stop_1", "stop_2"], "2024-01-01", headers))
+        
+        assert mock_send_trips_data.call_count == 2
+        uploaded = {call[0][2]: call[0] for call in mock_send_trips_data.call_args_list}
+        assert set(uploaded) == {"stop_1", "stop_2"}
+        assert uploaded["stop_1"][0] is mock_storage_client
+        assert uploaded["stop_1"][1]["stop"][0] == "stop_1"
+        assert uploaded["stop_1"][3] == "2024-01-01"
+
+    @patch('at_bus_load.get_at_api_data.send_trips_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.get_trips_data')
+    def test_concurrent_trip_fetch(self, mock_get_trips_data, mock_send_trips_data, mock_storage_client):
+        """Test that the trips of several stops are fetched at the same time."""
+        # Each fetch waits for a second one to start, which only happens if they overlap
+        barrier = threading.Barrier(2)
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+        
+        def blocking_get_trips_data(stop_id, api_date, headers):
+            with lock:
+                in_flight["current"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["current"])
+            barrier.wait(timeout=5)
+            with lock:
+                in_flight["current"] -= 1
+            return pl.DataFrame({"stop": [stop_id]})
+        
+        mock_get_trips_data.side_effect = blocking_get_trips_data
+        stop_ids = [f"stop_{i}" for i in range(8)]
+        
+        asyncio.run(get_and_send_all_trips_data(mock_storage_client, stop_ids, "2024-01-01", {}))
+        
+        assert in_flight["peak"] > 1
+        assert mock_send_trips_data.call_count == 8
+
+    @patch('at_bus_load.get_at_api_data.send_trips_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.get_trips_data')
+    def test_get_and_send_all_trips_data_skips_empty(self, mock_get_trips_data, mock_send_trips_data, mock_storage_client):
+        """Test that stops without trips data are not uploaded."""
+        mock_get_trips_data.side_effect = lambda stop_id, api_date, headers: (
+            pl.DataFrame() if stop_id == "stop_1" else pl.DataFrame({"stop": [stop_id]})
+        )
+        
+        asyncio.run(get_and_send_all_trips_data(mock_storage_client, ["stop_1", "stop_2"], "2024-01-01", {}))
+        
+        mock_send_trips_data.assert_called_once()
+        assert mock_send_trips_data.call_args[0][2] == "stop_2"
+
+    @patch('at_bus_load.get_at_api_data.send_trips_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.get_trips_data')
+    def test_get_and_send_all_trips_data_upload_error(self, mock_get_trips_data, mock_send_trips_data, mock_storage_client):
+        """Test that an upload error is propagated."""
+        mock_get_trips_data.return_value = pl.DataFrame({"stop": ["stop_1"]})
+        mock_send_trips_data.side_effect = google.api_core.exceptions.ServiceUnavailable("Upload failed")
+        
+        with pytest.raises(google.api_core.exceptions.ServiceUnavailable, match="Upload failed"):
+            asyncio.run(get_and_send_all_trips_data(mock_storage_client, ["stop_1"], "2024-01-01", {}))
+
+
+class TestSendAllDataToGcs:
+    """Test cases for send_all_data_to_gcs function."""
+
+    @patch('at_bus_load.get_at_api_data.get_and_send_all_trips_data')
+    @patch('at_bus_load.get_at_api_data.send_stop_data_to_gcs')
+    def test_send_all_data_to_gcs_success(self, mock_send_stop_data, mock_get_and_send_trips, mock_storage_client):
+        """Test that the stops upload and the trips pipeline share the client and the date."""
+        df_stops = pl.DataFrame({"id": ["stop_1", "stop_2"]})
+        headers = {"Ocp-Apim-Subscription-Key": "test-api-key"}
+        
+        asyncio.run(send_all_data_to_gcs(mock_storage_client, df_stops, "2024-01-01", headers))
+        
+        mock_send_stop_data.assert_called_once_with(mock_storage_client, df_stops, "2024-01-01")
+        mock_get_and_send_trips.assert_called_once_with(
+            mock_storage_client, ["stop_1", "stop_2"], "2024-01-01", headers
+        )
+
+    @patch('at_bus_load.get_at_api_data.send_trips_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.get_trips_data')
+    @patch('at_bus_load.get_at_api_data.send_stop_data_to_gcs')
+    def test_stops_upload_overlaps_trips_fetch(self, mock_send_stop_data, mock_get_trips_data, mock_send_trips_data, mock_storage_client):
+        """Test that the stops upload does not hold back the trips fetches."""
+        trips_fetched = threading.Event()
+        
+        def send_stop_data_once_trips_fetched(*args):
+            # Only returns if the trips are fetched while the stops upload is in flight
+            assert trips_fetched.wait(timeout=5), "The trips were not fetched during the stops upload"
+        
+        def get_trips_data(stop_id, api_date, headers):
+            trips_fetched.set()
+            return pl.DataFrame({"stop": [stop_id]})
+        
+        mock_send_stop_data.side_effect = send_stop_data_once_trips_fetched
+        mock_get_trips_data.side_effect = get_trips_data
+        
+        asyncio.run(send_all_data_to_gcs(mock_storage_client, pl.DataFrame({"id": ["stop_1"]}), "2024-01-01", {}))
+        
+        mock_send_trips_data.assert_called_once()
+
+    @patch('at_bus_load.get_at_api_data.get_and_send_all_trips_data')
+    @patch('at_bus_load.get_at_api_data.send_stop_data_to_gcs')
+    def test_send_all_data_to_gcs_stops_error(self, mock_send_stop_data, mock_get_and_send_trips, mock_storage_client):
+        """Test that a stops upload error is propagated."""
+        mock_send_stop_data.side_effect = google.api_core.exceptions.ServiceUnavailable("Upload failed")
+        
+        with pytest.raises(google.api_core.exceptions.ServiceUnavailable, match="Upload failed"):
+            asyncio.run(send_all_data_to_gcs(mock_storage_client, pl.DataFrame({"id": ["stop_1"]}), "2024-01-01", {}))
+
+
 class TestSendTripsDataToGcs:
     """Test cases for send_trips_data_to_gcs function."""
 
     @patch('at_bus_load.get_at_api_data.pl.DataFrame.write_parquet')
     def test_send_trips_data_to_gcs_success(self, mock_write_parquet, mock_storage_client, sample_trips_data):
         """Test successful upload of trips data to GCS."""
+        mock_bucket = mock_storage_client.bucket.return_value
+        mock_blob = mock_bucket.blob.return_value
+        
         send_trips_data_to_gcs(mock_storage_client, sample_trips_data, "route_001", "2024-01-01")
         
         # Verify the bucket and blob were accessed correctly
         mock_storage_client.bucket.assert_called_once_with("at-bus-open-data")
-        mock_storage_client.bucket().blob.assert_called_once_with("2024-01-01/trips_route_001.parquet")
+        mock_bucket.blob.assert_called_once_with("2024-01-01/trips_route_001.parquet")
         
-        # Verify the parquet file was written
-        mock_write_parquet.assert_called_once_with("data/trips_route_001.parquet")
+        # Verify the parquet file was written in memory
+        mock_write_parquet.assert_called_once()
+        assert isinstance(mock_write_parquet.call_args[0][0], io.BytesIO)
         
         # Verify the blob was uploaded
-        mock_storage_client.bucket().blob().upload_from_filename.assert_called_once_with("data/trips_route_001.parquet")
+        mock_blob.upload_from_file.assert_called_once()
 
     def test_send_trips_data_to_gcs_exception_handling(self, mock_storage_client, sample_trips_data):
         """Test exception handling in send_trips_data_to_gcs."""
         # Make the upload fail
-        mock_storage_client.bucket().blob().upload_from_filename.side_effect = Exception("Upload failed")
+        mock_storage_client.bucket.return_value.blob.return_value.upload_from_file.side_effect = google.api_core.exceptions.ServiceUnavailable("Upload failed")
+        
+        with pytest.raises(google.api_core.exceptions.ServiceUnavailable, match="Upload failed"):
+            send_trips_data_to_gcs(mock_storage_client, sample_trips_data, "route_001", "2024-01-01")
+
+
+class TestMain:
+    """Test cases for the main function."""
+
+    @patch('at_bus_load.get_at_api_data.send_all_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.ConnectGCS')
+    @patch('at_bus_load.get_at_api_data.get_stops_data')
+    @patch('at_bus_load.get_at_api_data.get_at_api_headers')
+    def test_main_uploads_filtered_stops(
+        self, mock_get_headers, mock_get_stops_data, mock_connect_gcs, mock_send_all_data, mock_storage_client
+    ):
+        """Test that the filtered stops are uploaded with the GCS client."""
+        mock_get_headers.return_value = {"Ocp-Apim-Subscription-Key": "test-api-key"}
+        mock_get_stops_data.return_value = pl.DataFrame({"stop_code": ["8147", "9999"], "stop_id": ["8147-1", "9999-1"]})
+        mock_connect_gcs.return_value.client = mock_storage_client
+        
+        main(date="2024-01-01", env_var_token=None)
+        
+        mock_send_all_data.assert_called_once()
+        client, df_stops, api_date, headers = mock_send_all_data.call_args[0]
+        assert client is mock_storage_client
+        assert df_stops["stop_code"].to_list() == ["8147"]
+        assert api_date == datetime.date(2024, 1, 1)
+        assert headers is mock_get_headers.return_value
+
+    @patch('at_bus_load.get_at_api_data.send_all_data_to_gcs')
+    @patch('at_bus_load.get_at_api_data.ConnectGCS')
+    @patch('at_bus_load.get_at_api_data.get_stops_data')
+    @patch('at_bus_load.get_at_api_data.get_at_api_headers')
+    def test_main_no_stops_skips_gcs(
+        self, mock_get_headers, mock_get_stops_data, mock_connect_gcs, mock_send_all_data
+    ):
+        """Test that the GCS client is not built when no stop is left to upload."""
+        mock_get_stops_data.return_value = pl.DataFrame({"stop_code": ["9999"], "stop_id": ["9999-1"]})
+        mock_client = PropertyMock()
+        type(mock_connect_gcs.return_value).client = mock_client
+        
+        main(date="2024-01-01", env_var_token=None)
         
-        with pytest.raises(Exception, match="Upload failed"):
-            send_trips_data_to_gcs(mock_storage_client, sample_trips_data, "route_001", "2024-01-01") 
\ No newline at end of file
+        mock_client.assert_not_called()
+        mock_send_all_data.assert_not_called()
@@ -1,314 +1,209 @@
 """
 Unit tests for move_gcs_data_to_bq module.
 """
-import re
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, call, patch
 
+import google.api_core.exceptions
 import pytest
-from google.cloud import bigquery, storage
+import typer
+from google.cloud import bigquery
 
 from at_bus_load.move_gcs_data_to_bq import (
-    get_all_route_id_from_trips_file_name,
-    move_parquet_file_to_bq_dataset,
-    move_stops_data_to_bq,
-    move_trips_data_to_bq
+    find_source_files,
+    main,
+    submit_parquet_load,
+    wait_for_load_jobs
 )
 
 
-class TestMoveParquetFileToBqDataset:
-    """Test cases for move_parquet_file_to_bq_dataset function."""
+def _stops_load_call(bq_client, bucket_name):
+    """Expected submit_parquet_load call loading the 2024-01-01 stops file."""
+    return call(
+        bq_client,
+        'at_bus_bronze',  # dataset_id
+        'stops$20240101',  # table_id
+        f'gs://{bucket_name}/2024-01-01/stops.parquet'  # source_uri
+    )
 
-    def test_move_parquet_file_to_bq_dataset_success(self, mock_bigquery_client):
-        """Test successful loading of parquet file to BigQuery."""
+
+def _trips_load_call(bq_client, bucket_name):
+    """Expected submit_parquet_load call loading every 2024-01-01 trips file."""
+    return call(
+        bq_client,
+        'at_bus_bronze',
+        'trips$20240101',
+        f'gs://{bucket_name}/2024-01-01/trips_*.parquet'
+    )
+
+
+class TestSubmitParquetLoad:
+    """Test cases for submit_parquet_load function."""
+
+    def test_submit_parquet_load_success(self, mock_bigquery_client):
+        """Test that the parquet file is loaded with the partitioned job config."""
         source_uri = "gs://test-bucket/test-file.parquet"
-        dataset_id = "test_dataset"
-        table_id = "test_table"
         
-        move_parquet_file_to_bq_dataset(
-            mock_bigquery_client, dataset_id, table_id, source_uri
+        submit_parquet_load(
+            mock_bigquery_client, "test_dataset", "test_table", source_uri
         )
         
-        # Verify dataset and table were accessed correctly
-        mock_bigquery_client.dataset.assert_called_once_with(dataset_id)
-        mock_bigquery_client.dataset().table.assert_called_once_with(table_id)
-        
         # Verify load_table_from_uri was called with correct parameters
         mock_bigquery_client.load_table_from_uri.assert_called_once()
         call_args = mock_bigquery_client.load_table_from_uri.call_args
         assert call_args[0][0] == source_uri  # source_uri
-        assert call_args[0][1] == mock_bigquery_client.dataset().table()  # table_ref
+        assert call_args[0][1] == "test-project.test_dataset.test_table"  # table_ref
         
         # Verify job config
         job_config = call_args[1]['job_config']
         assert job_config.source_format == bigquery.SourceFormat.PARQUET
         assert job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
-        
-        # Verify job.result() was called
-        mock_bigquery_client.load_table_from_uri().result.assert_called_once()
+        assert job_config.time_partitioning.type_ == bigquery.TimePartitioningType.DAY
+        assert job_config.time_partitioning.field == "api_date_ingestion"
 
-    def test_move_parquet_file_to_bq_dataset_exception_handling(self, mock_bigquery_client):
-        """Test exception handling in move_parquet_file_to_bq_dataset."""
-        # Make the load job fail
-        mock_bigquery_client.load_table_from_uri().result.side_effect = Exception("Load failed")
+    def test_submit_parquet_load_does_not_wait(self, mock_bigquery_client):
+        """Test that the load job is returned without waiting for it."""
+        load_job = mock_bigquery_client.load_table_from_uri.return_value
         
-        with pytest.raises(Exception, match="Load failed"):
-            move_parquet_file_to_bq_dataset(
-                mock_bigquery_client, "dataset", "table", "gs://bucket/file.parquet"
-            )
-
-
-class TestMoveStopsDataToBq:
-    """Test cases for move_stops_data_to_bq function."""
-
-    @patch('at_bus_load.move_gcs_data_to_bq.move_parquet_file_to_bq_dataset')
-    def test_move_stops_data_to_bq_success(self, mock_move_parquet, mock_bigquery_client):
-        """Test successful moving of stops data to BigQuery."""
-        source_bucket_name = "test-bucket"
-        exec_date = "2024-01-01"
-        
-        move_stops_data_to_bq(mock_bigquery_client, source_bucket_name, exec_date)
-        
-        # Verify move_parquet_file_to_bq_dataset was called with correct parameters
-        mock_move_parquet.assert_called_once_with(
-            mock_bigquery_client,
-            'at_bus_bronze',  # dataset_id
-            'stops_2024-01-01',  # table_id
-            'gs://test-bucket/2024-01-01/stops.parquet'  # source_uri
+        result = submit_parquet_load(
+            mock_bigquery_client, "dataset", "table", "gs://bucket/file.parquet"
         )
+        
+        assert result is load_job
+        load_job.result.assert_not_called()
 
 
-class TestGetAllRouteIdFromTripsFileName:
-    """Test cases for get_all_route_id_from_trips_file_name function."""
+class TestFindSourceFiles:
+    """Test cases for find_source_files function."""
 
-    def test_get_all_route_id_from_trips_file_name_success(self, mock_storage_client, mock_gcs_blobs):
-        """Test successful extraction of route IDs from file names."""
-        # Mock blob names that match the pattern
-        blob_names = [
+    def test_find_source_files_all_present(self, mock_storage_client, mock_gcs_blobs):
+        """Test that the stops file and the trips files are found with one listing."""
+        mock_storage_client.list_blobs.return_value = mock_gcs_blobs([
+            "2024-01-01/stops.parquet",
             "2024-01-01/trips_route_001.parquet",
-            "2024-01-01/trips_route_002.parquet", 
-            "2024-01-01/stops.parquet",  # Should be ignored
-            "2024-01-01/trips_route_003.parquet"
-        ]
-        mock_blobs = mock_gcs_blobs(blob_names)
-        
-        # Set up the mock bucket and its list_blobs method
-        mock_bucket = Mock()
-        mock_bucket.list_blobs.return_value = mock_blobs
-        mock_storage_client.get_bucket.return_value = mock_bucket
+            "2024-01-01/trips_route_002.parquet"
+        ])
         
-        result = get_all_route_id_from_trips_file_name(
-            mock_storage_client, "test-bucket", "2024-01-01"
-        )
+        result = find_source_files(mock_storage_client, "test-bucket", "2024-01-01")
         
-        # Verify the bucket was accessed correctly
-        mock_storage_client.get_bucket.assert_called_once_with("test-bucket")
-        mock_bucket.list_blobs.assert_called_once_with(
-            prefix="2024-01-01"
+        assert result == (True, True)
+        mock_storage_client.list_blobs.assert_called_once_with(
+            "test-bucket",
+            prefix="2024-01-01/",
+            fields="items(name),nextPageToken"
         )
-        
-        # Verify the correct route IDs were extracted
-        expected_route_ids = ["route_001", "route_002", "route_003"]
-        assert result == expected_route_ids
 
-    def test_get_all_route_id_from_trips_file_name_no_matches(self, mock_storage_client, mock_gcs_blobs):
-        """Test when no files match the trips pattern."""
-        # Mock blob names that don't match the pattern
-        blob_names = [
-            "2024-01-01/stops.parquet",
-            "2024-01-01/other_file.txt"
-        ]
-        mock_blobs = mock_gcs_blobs(blob_names)
+    def test_find_source_files_missing_stops(self, mock_storage_client, mock_gcs_blobs):
+        """Test that a missing stops file is reported."""
+        mock_storage_client.list_blobs.return_value = mock_gcs_blobs([
+            "2024-01-01/other_file.txt",
+            "2024-01-01/trips_route_001.parquet"
+        ])
         
-        # Set up the mock bucket and its list_blobs method
-        mock_bucket = Mock()
-        mock_bucket.list_blobs.return_value = mock_blobs
-        mock_storage_client.get_bucket.return_value = mock_bucket
-        
-        result = get_all_route_id_from_trips_file_name(
-            mock_storage_client, "test-bucket", "2024-01-01"
-        )
-        
-        # Should return empty list when no matches
-        assert result == []
+        assert find_source_files(mock_storage_client, "test-bucket", "2024-01-01") == (False, True)
 
-    def test_get_all_route_id_from_trips_file_name_empty_bucket(self, mock_storage_client):
-        """Test when bucket is empty or has no matching files."""
-        # Set up the mock bucket and its list_blobs method
-        mock_bucket = Mock()
-        mock_bucket.list_blobs.return_value = []
-        mock_storage_client.get_bucket.return_value = mock_bucket
+    def test_find_source_files_empty_date(self, mock_storage_client):
+        """Test that nothing is found for a date without files."""
+        mock_storage_client.list_blobs.return_value = []
         
-        result = get_all_route_id_from_trips_file_name(
-            mock_storage_client, "test-bucket", "2024-01-01"
-        )
-        
-        # Should return empty list
-        assert result == []
+        assert find_source_files(mock_storage_client, "test-bucket", "2024-01-01") == (False, False)
 
-    def test_get_all_route_id_from_trips_file_name_complex_route_ids(self, mock_storage_client, mock_gcs_blobs):
-        """Test extraction of complex route IDs with special characters."""
-        # Mock blob names with complex route IDs
-        blob_names = [
-            "2024-01-01/trips_route-001-A.parquet",
-            "2024-01-01/trips_route_002_B.parquet",
-            "2024-01-01/trips_route003.parquet"
-        ]
-        mock_blobs = mock_gcs_blobs(blob_names)
+    def test_find_source_files_ignores_partial_matches(self, mock_storage_client, mock_gcs_blobs):
+        """Test that only names starting with 'trips_' and ending with '.parquet' around a route ID match."""
+        mock_storage_client.list_blobs.return_value = mock_gcs_blobs([
+            "2024-01-01/old_trips_route_002.parquet",
+            "2024-01-01/stops.parquet",
+            "2024-01-01/trips_.parquet",
+            "2024-01-01/trips_route_003.parquet.tmp"
+        ])
         
-        # Set up the mock bucket and its list_blobs method
-        mock_bucket = Mock()
-        mock_bucket.list_blobs.return_value = mock_blobs
-        mock_storage_client.get_bucket.return_value = mock_bucket
+        assert find_source_files(mock_storage_client, "test-bucket", "2024-01-01") == (True, False)
+
+    def test_find_source_files_stops_listing_once_all_found(self, mock_storage_client, mock_gcs_blobs):
+        """Test that the listing is not consumed past the first trips file."""
+        def _listed_blobs():
+            yield from mock_gcs_blobs([
+                "2024-01-01/stops.parquet",
+                "2024-01-01/trips_route_001.parquet"
+            ])
+            raise AssertionError("The listing should not be consumed further")
         
-        result = get_all_route_id_from_trips_file_name(
-            mock_storage_client, "test-bucket", "2024-01-01"
-        )
+        mock_storage_client.list_blobs.return_value = _listed_blobs()
         
-        # Verify the correct route IDs were extracted
-        expected_route_ids = ["route-001-A", "route_002_B", "route003"]
-        assert result == expected_route_ids
+        assert find_source_files(mock_storage_client, "test-bucket", "2024-01-01") == (True, True)
 
 
-class TestMoveTripsDataToBq:
-    """Test cases for move_trips_data_to_bq function."""
+class TestWaitForLoadJobs:
+    """Test cases for wait_for_load_jobs function."""
 
-    @patch('at_bus_load.move_gcs_data_to_bq.get_all_route_id_from_trips_file_name')
-    @patch('at_bus_load.move_gcs_data_to_bq.move_parquet_file_to_bq_dataset')
-    def test_move_trips_data_to_bq_success(
-        self, mock_move_parquet, mock_get_route_ids, mock_storage_client, mock_bigquery_client
-    ):
-        """Test successful moving of trips data to BigQuery."""
-        route_ids = ["route_001", "route_002", "route_003"]
-        mock_get_route_ids.return_value = route_ids
-        
-        source_bucket_name = "test-bucket"
-        exec_date = "2024-01-01"
-        
-        move_trips_data_to_bq(
-            mock_storage_client, mock_bigquery_client, source_bucket_name, exec_date
-        )
-        
-        # Verify get_all_route_id_from_trips_file_name was called
-        mock_get_route_ids.assert_called_once_with(
-            mock_storage_client, source_bucket_name, exec_date
-        )
+    def test_wait_for_load_jobs_waits_for_each_job(self):
+        """Test that every job is waited for once, without a done() polling loop."""
+        load_jobs = [Mock(spec=bigquery.LoadJob), Mock(spec=bigquery.LoadJob)]
         
-        # Verify move_parquet_file_to_bq_dataset was called for each route
-        assert mock_move_parquet.call_count == 3
+        wait_for_load_jobs(load_jobs)
         
-        # Check the calls were made with correct parameters
-        expected_calls = [
-            (
-                mock_bigquery_client,
-                'at_bus_bronze',
-                'trips_route_001_2024-01-01',
-                'gs://test-bucket/2024-01-01/trips_route_001.parquet'
-            ),
-            (
-                mock_bigquery_client,
-                'at_bus_bronze',
-                'trips_route_002_2024-01-01',
-                'gs://test-bucket/2024-01-01/trips_route_002.parquet'
-            ),
-            (
-                mock_bigquery_client,
-                'at_bus_bronze',
-                'trips_route_003_2024-01-01',
-                'gs://test-bucket/2024-01-01/trips_route_003.parquet'
-            )
-        ]
-        
-        for i, expected_call in enumerate(expected_calls):
-            actual_call = mock_move_parquet.call_args_list[i]
-            assert actual_call[0] == expected_call
+        for load_job in load_jobs:
+            load_job.result.assert_called_once_with()
+            load_job.done.assert_not_called()
 
-    @patch('at_bus_load.move_gcs_data_to_bq.get_all_route_id_from_trips_file_name')
-    @patch('at_bus_load.move_gcs_data_to_bq.move_parquet_file_to_bq_dataset')
-    def test_move_trips_data_to_bq_no_routes(
-        self, mock_move_parquet, mock_get_route_ids, mock_storage_client, mock_bigquery_client
-    ):
-        """Test moving trips data when no routes are found."""
-        mock_get_route_ids.return_value = []
-        
-        source_bucket_name = "test-bucket"
-        exec_date = "2024-01-01"
-        
-        move_trips_data_to_bq(
-            mock_storage_client, mock_bigquery_client, source_bucket_name, exec_date
-        )
-        
-        # Verify get_all_route_id_from_trips_file_name was called
-        mock_get_route_ids.assert_called_once_with(
-            mock_storage_client, source_bucket_name, exec_date
-        )
-        
-        # Verify move_parquet_file_to_bq_dataset was not called
-        mock_move_parquet.assert_not_called()
+    def test_wait_for_load_jobs_no_jobs(self):
+        """Test that nothing happens without jobs."""
+        wait_for_load_jobs([])
 
-    @patch('at_bus_load.move_gcs_data_to_bq.get_all_route_id_from_trips_file_name')
-    @patch('at_bus_load.move_gcs_data_to_bq.move_parquet_file_to_bq_dataset')
-    def test_move_trips_data_to_bq_exception_handling(
-        self, mock_move_parquet, mock_get_route_ids, mock_storage_client, mock_bigquery_client
-    ):
-        """Test exception handling in move_trips_data_to_bq."""
-        route_ids = ["route_001"]
-        mock_get_route_ids.return_value = route_ids
-        mock_move_parquet.side_effect = Exception("Move failed")
-        
-        source_bucket_name = "test-bucket"
-        exec_date = "2024-01-01"
+    def test_wait_for_load_jobs_failure(self):
+        """Test that a failed load job is re-raised."""
+        failed_job = Mock(spec=bigquery.LoadJob)
+        failed_job.result.side_effect = google.api_core.exceptions.BadRequest("Load failed")
         
-        with pytest.raises(Exception, match="Move failed"):
-            move_trips_data_to_bq(
-                mock_storage_client, mock_bigquery_client, source_bucket_name, exec_date
-            )
+        with pytest.raises(google.api_core.exceptions.BadRequest, match="Load failed"):
+            wait_for_load_jobs([failed_job])
 
 
-class TestIntegrationScenarios:
-    """Integration test scenarios for the move_gcs_data_to_bq module."""
+class TestMain:
+    """Test cases for the main function."""
 
-    @patch('at_bus_load.move_gcs_data_to_bq.move_parquet_file_to_bq_dataset')
-    def test_full_stops_and_trips_workflow(
-        self, mock_move_parquet, mock_storage_client, mock_bigquery_client
+    @pytest.mark.parametrize(
+        "has_stops, has_trips, expected_loads",
+        [
+            (True, True, ["stops", "trips"]),
+            (True, False, ["stops"]),
+            (False, True, ["trips"]),
+            (False, False, []),
+        ]
+    )
+    @patch('at_bus_load.move_gcs_data_to_bq.wait_for_load_jobs')
+    @patch('at_bus_load.move_gcs_data_to_bq.submit_parquet_load')
+    @patch('at_bus_load.move_gcs_data_to_bq.find_source_files')
+    @patch('at_bus_load.move_gcs_data_to_bq.ConnectBQ')
+    @patch('at_bus_load.move_gcs_data_to_bq.ConnectGCS')
+    def test_main_submits_loads_of_found_files(
+        self, mock_connect_gcs, mock_connect_bq, mock_find_source_files, mock_submit, mock_wait,
+        has_stops, has_trips, expected_loads, mock_storage_client, mock_bigquery_client
     ):
-        """Test the complete workflow of moving both stops and trips data."""
-        # Test stops data movement
-        move_stops_data_to_bq(mock_bigquery_client, "test-bucket", "2024-01-01")
+        """Test that a load is submitted for each source file found, then waited for."""
+        mock_connect_gcs.return_value.client = mock_storage_client
+        mock_connect_bq.return_value.client = mock_bigquery_client
+        mock_find_source_files.return_value = (has_stops, has_trips)
+        submitted_jobs = [Mock(spec=bigquery.LoadJob) for _ in expected_loads]
+        mock_submit.side_effect = submitted_jobs
         
-        # Verify stops data was moved
-        mock_move_parquet.assert_called_with(
-            mock_bigquery_client,
-            'at_bus_bronze',
-            'stops_2024-01-01',
-            'gs://test-bucket/2024-01-01/stops.parquet'
-        )
-        
-        # Reset mock for trips test
-        mock_move_parquet.reset_mock()
+        main(date="2024-01-01", env_var_token=None)
         
-        # Mock route IDs for trips
-        with patch('at_bus_load.move_gcs_data_to_bq.get_all_route_id_from_trips_file_name') as mock_get_routes:
-            mock_get_routes.return_value = ["route_001", "route_002"]
-            
-            # Test trips data movement
-            move_trips_data_to_bq(
-                mock_storage_client, mock_bigquery_client, "test-bucket", "2024-01-01"
-            )
-            
-            # Verify trips data was moved for each route
-            assert mock_move_parquet.call_count == 2
-            calls = mock_move_parquet.call_args_list
-            
-            assert calls[0][0] == (
-                mock_bigquery_client,
-                'at_bus_bronze',
-                'trips_route_001_2024-01-01',
-                'gs://test-bucket/2024-01-01/trips_route_001.parquet'
-            )
-            
-            assert calls[1][0] == (
-                mock_bigquery_client,
-                'at_bus_bronze',
-                'trips_route_002_2024-01-01',
-                'gs://test-bucket/2024-01-01/trips_route_002.parquet'
-            ) 
\ No newline at end of file
+        mock_find_source_files.assert_called_once_with(
+            mock_storage_client, 'at-bus-open-data', '2024-01-01'
+        )
+        expected_calls = {
+            "stops": _stops_load_call(mock_bigquery_client, 'at-bus-open-data'),
+            "trips": _trips_load_call(mock_bigquery_client, 'at-bus-open-data')
+        }
+        assert mock_submit.call_args_list == [expected_calls[load] for load in expected_loads]
+        
+        # Every submitted job is waited for, in the order they were submitted
+        mock_wait.assert_called_once_with(submitted_jobs)
+
+    @patch('at_bus_load.move_gcs_data_to_bq.ConnectGCS')
+    def test_main_invalid_date(self, mock_connect_gcs):
+        """Test that an invalid date is rejected before connecting."""
+        with pytest.raises(typer.BadParameter):
+            main(date="01-01-2024", env_var_token=None)
+        
+        mock_connect_gcs.assert_not_called()